@@ -11,18 +11,21 @@ ESB 依赖与按路由注入的包装器
 """
 from __future__ import annotations
 
-import json
 import logging
 from typing import Callable, Optional, Dict, Any
 
-from fastapi import Request, Response, Depends
-from fastapi.responses import JSONResponse
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.routing import APIRoute
 
+from core import json_utils
 from core.esb_utils import EsbWrapper, EsbRespStatus
 
 logger = logging.getLogger(__name__)
 
+# 响应渲染：orjson 可用时使用 ORJSONResponse（C 实现，序列化大体积审查结果更快），否则回退到标准 JSONResponse
+DefaultJSONResponse = ORJSONResponse if json_utils.orjson is not None else JSONResponse
+
 
 class EsbRoute(APIRoute):
     """
@@ -45,13 +48,13 @@ class EsbRoute(APIRoute):
                     raw = await request.body()
                     if raw:
                         # 试图解析为 JSON 并判断是否为 ESB 包
-                        parsed = json.loads(raw)
+                        parsed = json_utils.loads(raw)
                         if isinstance(parsed, dict) and "ReqInfo" in parsed and "Request" in parsed:
                             esb_request = parsed
                             business_data = EsbWrapper.unwrap_request(parsed)
-                            new_body_bytes = json.dumps(business_data).encode("utf-8")
+                            new_body_bytes = json_utils.dumps(business_data).encode("utf-8")
                             logger.info(f"[ESB] Unwrapped request on {request.url.path}")
-                except json.JSONDecodeError:
+                except json_utils.JSONDecodeError:
                     # 不是 JSON，按原样透传，交由原路由处理
                     logger.debug("[ESB] Non-JSON body, bypassing ESB unwrap")
                 except Exception as e:
@@ -63,8 +66,8 @@ class EsbRoute(APIRoute):
                             error_message=str(e),
                             error_code="4001",
                         )
-                        return JSONResponse(content=esb_error, status_code=200)
-                    return JSONResponse(
+                        return DefaultJSONResponse(content=esb_error, status_code=200)
+                    return DefaultJSONResponse(
                         status_code=400,
                         content={"error": True, "message": f"Invalid ESB request: {str(e)}"},
                     )
@@ -111,8 +114,8 @@ class EsbRoute(APIRoute):
 
                 # 如果不是 JSON，按原样透传（少数场景下可能需要，但通常 ESB 期望 JSON）
                 try:
-                    business_resp = json.loads(body_bytes) if body_bytes else {}
-                except json.JSONDecodeError:
+                    business_resp = json_utils.loads(body_bytes) if body_bytes else {}
+                except json_utils.JSONDecodeError:
                     logger.warning("[ESB] Response is not JSON, returning as-is")
                     return Response(
                         content=body_bytes,
@@ -145,7 +148,7 @@ class EsbRoute(APIRoute):
                     k: v for k, v in dict(response.headers).items()
                     if k.lower() != "content-length"
                 }
-                return JSONResponse(
+                return DefaultJSONResponse(
                     content=esb_resp,
                     status_code=200,
                     headers=passthrough_headers,
@@ -160,14 +163,14 @@ class EsbRoute(APIRoute):
                         error_message=str(e),
                         error_code="9999",
                     )
-                    return JSONResponse(
+                    return DefaultJSONResponse(
                         content=esb_resp,
                         status_code=200,
                         background=getattr(response, "background", None),
                     )
                 except Exception:
                     # 若连 ESB 回包都失败，则退回 500 普通响应
-                    return JSONResponse(status_code=500, content={"error": True, "message": "Internal server error"})
+                    return DefaultJSONResponse(status_code=500, content={"error": True, "message": "Internal server error"})
 
         return custom_route_handler
 
@@ -2,22 +2,28 @@
 FastAPI主应用 - GitLab代码审查服务的REST API接口
 重构版本：只保留 /review 接口，全部通过 ESB 集成
 """
+import asyncio
+import time
 import uuid
 import logging
-from typing import Dict, List, Optional, Any
+from contextlib import aclosing
+from typing import Dict, List, Optional, Any, AsyncIterator
 from datetime import datetime
 import uvicorn
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, status
 from fastapi import APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field, field_validator
 
 from core.reviewer import GitLabReviewer
+from core.simple_ai_processor import SimpleOpenAIClient, close_shared_openai_clients
 from core.task_manager import init_task_manager, cleanup_task_manager, get_task_manager
+from core import json_utils
 from core.redis_client import get_redis_manager, close_redis_connection
 from config.settings import settings, REVIEW_TYPES
-from api.esb_dependency import EsbRoute
+from api.esb_dependency import EsbRoute, DefaultJSONResponse
 
 # 配置日志
 logging.basicConfig(
@@ -32,7 +38,8 @@ app = FastAPI(
     description="基于AI的GitLab代码审查服务 - ESB集成版",
     version=settings.service_version,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=DefaultJSONResponse
 )
 
 # 添加CORS中间件
@@ -44,6 +51,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩：审查结果 JSON 体积较大（findings/statistics/suggestions），按 Accept-Encoding 协商 gzip
+if settings.gzip_minimum_size > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=settings.gzip_minimum_size)
+
 # 路由级 ESB 包装：仅对需要的接口启用（替代全局中间件）
 esb_router = APIRouter(route_class=EsbRoute)
 
@@ -69,7 +80,7 @@ class ReviewRequest(BaseModel):
 
     review_type: str = Field(default="full", description="审查类型")
     ai_model: Optional[str] = Field(default=None, description="AI模型名称")
-    options: Optional[Dict[str, Any]] = Field(default_factory=dict, description="额外选项")
+    options: Optional[Dict[str, Any]] = Field(default_factory=dict, description="额外选项（mr模式支持 auto_comment_threshold：评分低于该值时由服务端将审查总结写入MR描述）")
     # 缓存控制：是否读取/写入缓存（历史问题与重复去重映射）。默认开启以保持兼容。
     use_cache: bool = Field(default=True, description="是否使用缓存（历史问题/重复去重）；默认True")
 
@@ -80,6 +91,20 @@ class ReviewRequest(BaseModel):
             raise ValueError(f'review_type must be one of: {list(REVIEW_TYPES.keys())}')
         return v
 
+    @field_validator('options')
+    @classmethod
+    def validate_options(cls, v):
+        # auto_comment_threshold 在审查完成后才使用，提前校验，避免无效值导致整个审查结果被丢弃
+        threshold = (v or {}).get('auto_comment_threshold')
+        if threshold is not None:
+            if isinstance(threshold, bool):
+                raise ValueError('options.auto_comment_threshold must be a number')
+            try:
+                v['auto_comment_threshold'] = float(threshold)
+            except (TypeError, ValueError):
+                raise ValueError('options.auto_comment_threshold must be a number')
+        return v
+
     @field_validator('gitlab_url')
     @classmethod
     def validate_gitlab_url(cls, v):
@@ -117,23 +142,43 @@ class TaskQueryRequest(BaseModel):
 # 全局变量
 app_start_time = datetime.now()
 
+# 根路径返回内容是静态的，启动时序列化一次，请求时直接返回 bytes
+_ROOT_RESPONSE_BODY = json_utils.dumps_bytes({
+    "message": "GitLab Code Reviewer API - ESB Integration",
+    "version": settings.service_version,
+    "docs": "/docs",
+    "health": "/health"
+})
+
+
+# 审查并发上限：同步与异步审查共享。信号量是进程内状态，多个 uvicorn 工作进程时每个进程分别限制
+_review_semaphore = asyncio.Semaphore(max(settings.max_concurrent_reviews, 1))
+
 
 # 依赖函数
-async def get_reviewer(request: ReviewRequest) -> GitLabReviewer:
-    """创建审查器实例"""
+async def get_reviewer(request: ReviewRequest) -> AsyncIterator[GitLabReviewer]:
+    """
+    创建审查器实例，请求结束后释放其GitLab连接池
+
+    审查器持有每次审查的可变状态（AI处理器、审查状态、文件内容缓存），因此按请求创建、不跨请求共享；
+    无状态的 OpenAI 客户端与连接池已在进程内共享
+    """
     try:
         reviewer = GitLabReviewer(
             gitlab_url=request.gitlab_url,
             access_token=request.access_token,
             ai_model=request.ai_model
         )
-        return reviewer
     except Exception as e:
         logger.error(f"Failed to create reviewer: {e}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Failed to initialize reviewer: {str(e)}"
         )
+    try:
+        yield reviewer
+    finally:
+        reviewer.close()
 
 
 async def execute_review_task(task_id: str, request: ReviewRequest):
@@ -144,6 +189,7 @@ async def execute_review_task(task_id: str, request: ReviewRequest):
         task_id: 任务ID
         request: 审查请求
     """
+    reviewer = None
     try:
         task_mgr = get_task_manager()
 
@@ -161,36 +207,42 @@ async def execute_review_task(task_id: str, request: ReviewRequest):
             ai_model=request.ai_model
         )
 
-        await update_progress(20, "开始执行审查...")
+        # 限制本进程同时执行的审查数量（MAX_CONCURRENT_REVIEWS），超出的任务排队等待，避免异步任务无上限地压向AI后端
+        await update_progress(15, "等待审查资源...")
 
-        # 执行审查（根据模式）
-        if request.mode == "mr":
-            if not request.mr_id:
-                raise ValueError("mr_id is required for 'mr' mode")
-
-            await update_progress(30, f"审查 MR !{request.mr_id}...")
-            result = await reviewer.review_merge_request(
-                project_id=request.project_id,
-                mr_id=request.mr_id,
-                review_type=request.review_type,
-                options=request.options
-            )
+        async with _review_semaphore:
+            await update_progress(20, "开始执行审查...")
 
-        elif request.mode == "branch_compare":
-            if not request.target_branch or not request.source_branch:
-                raise ValueError("target_branch and source_branch are required for 'branch_compare' mode")
-
-            await update_progress(30, f"比较分支 {request.source_branch} vs {request.target_branch}...")
-            result = await reviewer.review_branch_comparison(
-                project_id=request.project_id,
-                target_branch=request.target_branch,
-                source_branch=request.source_branch,
-                review_type=request.review_type,
-                task_id=request.devops_task_id,
-                use_cache=request.use_cache if request.use_cache is not None else True
-            )
-        else:
-            raise ValueError(f"Invalid mode: {request.mode}")
+            # 执行审查（根据模式）
+            if request.mode == "mr":
+                if not request.mr_id:
+                    raise ValueError("mr_id is required for 'mr' mode")
+
+                await update_progress(30, f"审查 MR !{request.mr_id}...")
+                result = await reviewer.review_merge_request(
+                    project_id=request.project_id,
+                    mr_id=request.mr_id,
+                    review_type=request.review_type,
+                    options=request.options,
+                    allow_batch=True
+                )
+
+            elif request.mode == "branch_compare":
+                if not request.target_branch or not request.source_branch:
+                    raise ValueError("target_branch and source_branch are required for 'branch_compare' mode")
+
+                await update_progress(30, f"比较分支 {request.source_branch} vs {request.target_branch}...")
+                result = await reviewer.review_branch_comparison(
+                    project_id=request.project_id,
+                    target_branch=request.target_branch,
+                    source_branch=request.source_branch,
+                    review_type=request.review_type,
+                    task_id=request.devops_task_id,
+                    use_cache=request.use_cache if request.use_cache is not None else True,
+                    allow_batch=True
+                )
+            else:
+                raise ValueError(f"Invalid mode: {request.mode}")
 
         await update_progress(90, "审查完成，保存结果...")
 
@@ -201,6 +253,9 @@ async def execute_review_task(task_id: str, request: ReviewRequest):
         logger.error(f"Task {task_id} failed: {e}")
         task_mgr = get_task_manager()
         await task_mgr.fail_task(task_id, str(e))
+    finally:
+        if reviewer is not None:
+            reviewer.close()
 
 
 # ============================================================================
@@ -210,22 +265,32 @@ async def execute_review_task(task_id: str, request: ReviewRequest):
 @app.get("/", response_model=Dict[str, str])
 async def root():
     """根路径 - API信息"""
-    return {
-        "message": "GitLab Code Reviewer API - ESB Integration",
-        "version": settings.service_version,
-        "docs": "/docs",
-        "health": "/health"
-    }
+    return Response(content=_ROOT_RESPONSE_BODY, media_type="application/json")
+
+
+# 健康检查响应按秒缓存：存活/就绪探针调用频繁，1秒内直接复用已序列化的响应体
+HEALTH_CACHE_TTL = 1.0
+_health_cache = {"expires_at": 0.0, "body": b""}
 
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """健康检查"""
-    return HealthResponse(
-        status="healthy",
-        version=settings.service_version,
-        timestamp=datetime.now().isoformat()
-    )
+    now = time.time()
+    if now >= _health_cache["expires_at"]:
+        _health_cache["body"] = json_utils.dumps_bytes({
+            "status": "healthy",
+            "version": settings.service_version,
+            "timestamp": datetime.fromtimestamp(now).isoformat()
+        })
+        _health_cache["expires_at"] = now + HEALTH_CACHE_TTL
+    return Response(content=_health_cache["body"], media_type="application/json")
+
+
+@app.head("/health", include_in_schema=False)
+async def health_check_head():
+    """轻量健康检查：只看状态码的探针使用 HEAD，无需生成和传输响应体"""
+    return Response(status_code=status.HTTP_200_OK)
 
 
 @esb_router.post("/review", response_model=ReviewResponse)
@@ -254,12 +319,13 @@ async def review_merge_request(
                 )
 
             logger.info(f"[ESB] Mode: MR review for !{request.mr_id}")
-            result = await reviewer.review_merge_request(
-                project_id=request.project_id,
-                mr_id=request.mr_id,
-                review_type=request.review_type,
-                options=request.options
-            )
+            async with _review_semaphore:
+                result = await reviewer.review_merge_request(
+                    project_id=request.project_id,
+                    mr_id=request.mr_id,
+                    review_type=request.review_type,
+                    options=request.options
+                )
 
         elif request.mode == "branch_compare":
             if not request.target_branch or not request.source_branch:
@@ -269,14 +335,15 @@ async def review_merge_request(
                 )
 
             logger.info(f"[ESB] Mode: Branch comparison between '{request.source_branch}' and '{request.target_branch}'")
-            result = await reviewer.review_branch_comparison(
-                project_id=request.project_id,
-                target_branch=request.target_branch,
-                source_branch=request.source_branch,
-                review_type=request.review_type,
-                task_id=request.devops_task_id,
-                use_cache=request.use_cache if request.use_cache is not None else True
-            )
+            async with _review_semaphore:
+                result = await reviewer.review_branch_comparison(
+                    project_id=request.project_id,
+                    target_branch=request.target_branch,
+                    source_branch=request.source_branch,
+                    review_type=request.review_type,
+                    task_id=request.devops_task_id,
+                    use_cache=request.use_cache if request.use_cache is not None else True
+                )
 
         else:
             raise HTTPException(
@@ -314,6 +381,7 @@ async def async_review(request: ReviewRequest, background_tasks: BackgroundTasks
     - message: 提示信息
     - progress_url: 进度查询URL
     - result_url: 结果查询URL
+    - events_url: 进度事件订阅URL（SSE，可替代轮询）
     """
     try:
         task_id = str(uuid.uuid4())
@@ -336,7 +404,8 @@ async def async_review(request: ReviewRequest, background_tasks: BackgroundTasks
             "status": "pending",
             "message": "任务已提交，请使用task_id查询进度",
             "progress_url": "/review/progress",
-            "result_url": "/review/result"
+            "result_url": "/review/result",
+            "events_url": f"/review/events/{task_id}"
         }
 
     except Exception as e:
@@ -380,8 +449,8 @@ async def get_task_progress(request: TaskQueryRequest):
             "status": task.status,
             "progress": task.progress,
             "message": task.message,
-            "created_at": task.created_at,
-            "updated_at": task.updated_at
+            "created_at": datetime.fromtimestamp(task.created_at).isoformat(),
+            "updated_at": datetime.fromtimestamp(task.updated_at).isoformat()
         }
 
     except HTTPException:
@@ -449,6 +518,41 @@ async def get_task_result(request: TaskQueryRequest):
         )
 
 
+@app.get("/review/events/{task_id}")
+async def stream_task_events(task_id: str):
+    """
+    订阅任务进度事件（Server-Sent Events），替代轮询 /review/progress
+
+    每次进度更新推送一条 data 帧（JSON：task_id/status/progress/message/updated_at，失败时含 error），
+    任务完成或失败后结束；空闲时发送注释帧保持连接。完成后请通过 /review/result 获取结果。
+
+    注意：流式响应无法按 ESB 格式回包，此接口不经过 ESB 路由，需直连访问
+    """
+    task_mgr = get_task_manager()
+    if not await task_mgr.get_task(task_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Task {task_id} not found"
+        )
+
+    async def event_stream():
+        # aclosing：任务结束或客户端断开时立即关闭订阅，归还 Pub/Sub 占用的 Redis 连接，而不是等到被 GC
+        async with aclosing(task_mgr.subscribe_task_events(task_id)) as events:
+            async for event in events:
+                if event is None:
+                    yield b": keep-alive\n\n"
+                    continue
+                event["updated_at"] = datetime.fromtimestamp(float(event["updated_at"])).isoformat()
+                yield b"data: " + json_utils.dumps_bytes(event) + b"\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 已声明 Content-Encoding 的响应不会被 GZipMiddleware 压缩，避免事件被压缩缓冲延迟推送
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Content-Encoding": "identity"}
+    )
+
+
 # ============================================================================
 # 错误处理
 # ============================================================================
@@ -457,7 +561,7 @@ async def get_task_result(request: TaskQueryRequest):
 async def http_exception_handler(request, exc):
     """HTTP异常处理器"""
     logger.error(f"HTTP {exc.status_code}: {exc.detail}")
-    return JSONResponse(
+    return DefaultJSONResponse(
         status_code=exc.status_code,
         content={
             "error": True,
@@ -472,7 +576,7 @@ async def http_exception_handler(request, exc):
 async def general_exception_handler(request, exc):
     """通用异常处理器"""
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return DefaultJSONResponse(
         status_code=500,
         content={
             "error": True,
@@ -509,6 +613,13 @@ async def startup_event():
     logger.info("Initializing TaskManager (using shared Redis connection)")
     init_task_manager(task_ttl=settings.redis_task_ttl)
 
+    # 预热共享的 OpenAI 客户端（SDK 初始化与连接池构建），避免由首个审查请求承担该开销
+    try:
+        SimpleOpenAIClient(api_key=settings.openai_api_key, base_url=settings.api_base_url)
+        logger.info("✓ OpenAI client preloaded")
+    except Exception as e:
+        logger.warning(f"✗ OpenAI client preload failed - will retry on first review: {e}")
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -523,6 +634,9 @@ async def shutdown_event():
     await close_redis_connection()
     logger.info("Redis connection closed")
 
+    # 关闭共享的 OpenAI 客户端连接池
+    await close_shared_openai_clients()
+
 
 # 挂载仅对 /review* 生效的 ESB 路由
 app.include_router(esb_router)
@@ -530,10 +644,17 @@ app.include_router(esb_router)
 
 # 开发模式启动
 if __name__ == "__main__":
+    # 任务状态保存在 Redis 中，但并发上限与各类缓存是进程内状态：默认单进程，
+    # 显式设置 SERVER_WORKERS 时每个工作进程分别执行这些上限；热重载模式只能单进程运行
+    workers = 1 if settings.debug else max(settings.server_workers, 1)
+
     uvicorn.run(
         "api.main:app",
         host="0.0.0.0",
         port=8000,
         reload=settings.debug,
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
         log_level=settings.log_level.lower()
     )
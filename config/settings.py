@@ -4,7 +4,7 @@
 """
 import os
 from typing import Optional, List, Dict, Any
-from pydantic import Field, field_validator
+from pydantic import Field
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -18,6 +18,9 @@ class Settings(BaseSettings):
     service_version: str = Field(default="1.0.0", env="SERVICE_VERSION")
     debug: bool = Field(default=False, env="DEBUG")
     log_level: str = Field(default="INFO", env="LOG_LEVEL")
+    # uvicorn 工作进程数，默认单进程（reload 模式固定为 1）。并发上限与各类内存缓存均为进程内状态，
+    # 多进程时 MAX_CONCURRENT_REVIEWS / MAX_CONCURRENT_FILE_REVIEWS 按每个工作进程分别生效
+    server_workers: int = Field(default=1, env="SERVER_WORKERS")
     
     # AI模型配置
     openai_api_key: str = Field(..., env="OPENAI_API_KEY")
@@ -38,9 +41,13 @@ class Settings(BaseSettings):
     redis_task_ttl: int = Field(default=86400, env="REDIS_TASK_TTL")  # 任务过期时间（秒），默认24小时
     
     # 性能配置
-    max_concurrent_reviews: int = Field(default=10, env="MAX_CONCURRENT_REVIEWS")
+    max_concurrent_reviews: int = Field(default=10, env="MAX_CONCURRENT_REVIEWS")  # 每个工作进程的上限
     review_timeout_seconds: int = Field(default=300, env="REVIEW_TIMEOUT_SECONDS")
     token_cache_ttl: int = Field(default=3600, env="TOKEN_CACHE_TTL")
+    ai_response_cache_size: int = Field(default=256, env="AI_RESPONSE_CACHE_SIZE")  # 进程内单文件AI响应缓存条数，0为禁用
+    ai_response_cache_ttl: int = Field(default=3600, env="AI_RESPONSE_CACHE_TTL")  # 进程内AI响应缓存过期时间（秒）
+    security_analysis_cache_size: int = Field(default=1024, env="SECURITY_ANALYSIS_CACHE_SIZE")  # 进程内安全分析结论缓存条数，0为禁用
+    gzip_minimum_size: int = Field(default=1024, env="GZIP_MINIMUM_SIZE")  # 响应体超过该字节数且客户端支持时 gzip 压缩，0为禁用
     
     # GitLab配置
     default_gitlab_url: str = Field(default="https://gitlab.com", env="DEFAULT_GITLAB_URL")
@@ -49,7 +56,22 @@ class Settings(BaseSettings):
     # 文件内容处理配置
     max_file_lines: int = Field(default=1000, env="MAX_FILE_LINES")
     enable_per_file_review: bool = Field(default=True, env="ENABLE_PER_FILE_REVIEW")
-    max_concurrent_file_reviews: int = Field(default=5, env="MAX_CONCURRENT_FILE_REVIEWS")
+    max_concurrent_file_reviews: int = Field(default=5, env="MAX_CONCURRENT_FILE_REVIEWS")  # 每次审查的上限
+    # 自适应并发：根据延迟与限流(429)动态调整逐文件审查并发数，max_concurrent_file_reviews 作为上限
+    enable_adaptive_concurrency: bool = Field(default=True, env="ENABLE_ADAPTIVE_CONCURRENCY")
+    adaptive_concurrency_latency_threshold: float = Field(default=30.0, env="ADAPTIVE_CONCURRENCY_LATENCY_THRESHOLD")  # p95延迟阈值（秒）
+
+    # Batch API配置 - 适用于无需即时返回的审查（如webhook异步回调），成本约为实时调用的一半
+    enable_batch_mode: bool = Field(default=False, env="ENABLE_BATCH_MODE")
+    batch_mode_min_files: int = Field(default=10, env="BATCH_MODE_MIN_FILES")  # 文件数达到该值才走Batch
+    batch_mode_poll_interval: float = Field(default=5.0, env="BATCH_MODE_POLL_INTERVAL")  # 初始轮询间隔（秒），指数退避
+    batch_mode_max_wait_seconds: int = Field(default=3600, env="BATCH_MODE_MAX_WAIT_SECONDS")  # 超时后回退实时分析
+
+    # 提示词前缀缓存提示 - 请求携带 prompt_cache_key，并在每个静态前缀首次使用时发送一次预热请求
+    enable_prompt_cache_hints: bool = Field(default=False, env="ENABLE_PROMPT_CACHE_HINTS")
+
+    # 流式输出配置 - 逐文件分析边生成边增量解析findings，输出被截断时仍可保留已完成的findings
+    enable_streaming_completion: bool = Field(default=False, env="ENABLE_STREAMING_COMPLETION")
     
     # 安全配置
     api_key_header: str = Field(default="X-API-Key", env="API_KEY_HEADER")
@@ -93,6 +115,8 @@ class Settings(BaseSettings):
     # 结构化输出配置
     enable_structured_output: bool = Field(default=True, env="ENABLE_STRUCTURED_OUTPUT")
     force_structured_output: bool = Field(default=True, env="FORCE_STRUCTURED_OUTPUT")
+    # 是否由服务端校验JSON schema；关闭后改用提示词约束 + 客户端解析失败反馈重试
+    require_server_side_schema: bool = Field(default=True, env="REQUIRE_SERVER_SIDE_SCHEMA")
 
     def __init__(self, **kwargs):
         """初始化设置，手动处理allowed_hosts环境变量"""
@@ -2,11 +2,11 @@
 Redis缓存服务模块
 用于缓存审查结果和历史问题，提升重复审查的性能
 """
-import json
 import hashlib
 import logging
 from typing import Dict, List, Optional, Any
 from datetime import timedelta
+from core import json_utils
 from core.redis_client import get_redis_client
 
 logger = logging.getLogger(__name__)
@@ -153,7 +153,7 @@ class CacheService:
             if cached_data:
                 task_info = f" [task:{task_id}]" if task_id else ""
                 logger.info(f"Cache HIT for review: {project_id} commit:{source_commit[:8]}→{target_branch}{task_info}")
-                result = json.loads(cached_data)
+                result = json_utils.loads(cached_data)
                 # 添加缓存标记
                 result["from_cache"] = True
                 return result
@@ -194,7 +194,7 @@ class CacheService:
             )
 
             # 序列化结果
-            cached_data = json.dumps(review_result, ensure_ascii=False)
+            cached_data = json_utils.dumps(review_result)
 
             # 存储到Redis，设置过期时间
             await redis_client.setex(
@@ -243,7 +243,7 @@ class CacheService:
             if cached_data:
                 task_info = f" [task:{task_id}]" if task_id else ""
                 logger.info(f"Found historical issues for: {project_id}→{target_branch}{task_info}")
-                return json.loads(cached_data)
+                return json_utils.loads(cached_data)
             else:
                 task_info = f" [task:{task_id}]" if task_id else ""
                 logger.info(f"No historical issues found for: {project_id}→{target_branch}{task_info}")
@@ -300,7 +300,7 @@ class CacheService:
                 issues_by_file[filename].append(issue_summary)
 
             # 序列化并存储
-            cached_data = json.dumps(issues_by_file, ensure_ascii=False)
+            cached_data = json_utils.dumps(issues_by_file)
 
             await redis_client.setex(
                 history_key,
@@ -352,7 +352,7 @@ class CacheService:
 
             if cached_data:
                 logger.info(f"Duplicate HIT for review: {project_id} {source_branch}→{target_branch}{task_info}")
-                result = json.loads(cached_data)
+                result = json_utils.loads(cached_data)
                 result["from_cache"] = True
                 return result
             else:
@@ -374,7 +374,7 @@ class CacheService:
 
         try:
             dup_key = self._generate_duplicate_key(project_id, source_branch, target_branch, task_id)
-            cached_data = json.dumps(review_result, ensure_ascii=False)
+            cached_data = json_utils.dumps(review_result)
             await redis_client.setex(
                 dup_key,
                 int(self.review_cache_ttl.total_seconds()),
@@ -0,0 +1,89 @@
+"""
+自适应并发控制模块
+根据接口响应延迟与限流(429)情况动态调整并发上限，替代固定大小的信号量
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyController:
+    """
+    自适应并发控制器 (AIMD)
+
+    - 连续成功 increase_after 次后并发上限翻倍（不超过 max_limit）
+    - 遇到限流(429)时并发上限减半（不低于 min_limit）
+    - 最近请求的 p95 延迟超过 latency_threshold 时并发上限减一
+
+    使用方式与信号量一致：
+        async with controller:
+            ...
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 increase_after: int = 5, latency_threshold: Optional[float] = None,
+                 window_size: int = 20):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial_limit, self.min_limit), self.max_limit)
+        self.increase_after = increase_after
+        self.latency_threshold = latency_threshold
+
+        self._in_flight = 0
+        self._consecutive_successes = 0
+        self._latencies = deque(maxlen=window_size)
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        """获取一个并发槽位，超过当前上限时等待"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    async def release(self):
+        """释放并发槽位"""
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.release()
+
+    def record_success(self, latency: float):
+        """记录一次成功请求及其延迟"""
+        self._latencies.append(latency)
+
+        if self.latency_threshold and len(self._latencies) >= 5 and self._p95_latency() > self.latency_threshold:
+            self._consecutive_successes = 0
+            self._latencies.clear()
+            self._set_limit(self.limit - 1, f"p95延迟超过 {self.latency_threshold:.1f}秒")
+            return
+
+        self._consecutive_successes += 1
+        if self._consecutive_successes >= self.increase_after:
+            self._consecutive_successes = 0
+            self._set_limit(self.limit * 2, f"连续 {self.increase_after} 次成功")
+
+    def record_rate_limited(self):
+        """记录一次限流(429)响应"""
+        self._consecutive_successes = 0
+        self._set_limit(self.limit // 2, "触发限流(429)")
+
+    def _p95_latency(self) -> float:
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def _set_limit(self, new_limit: int, reason: str):
+        new_limit = min(max(new_limit, self.min_limit), self.max_limit)
+        if new_limit == self.limit:
+            return
+        logger.info(f"🔧 并发上限调整: {self.limit} -> {new_limit} ({reason})")
+        # 有任务等待时必然存在在途请求，其释放时会重新检查上限，无需额外唤醒
+        self.limit = new_limit
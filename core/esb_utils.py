@@ -1,11 +1,10 @@
 """
 ESB 工具类 - 用于处理 ESB 请求和响应的包裹
 """
-from datetime import date
 from enum import Enum
 import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 
 APP_NAME = "AIMP"
 
@@ -37,6 +36,23 @@ class Counter:
 counter = Counter()
 
 
+# 当前日期字符串按秒缓存：每个 ESB 响应都要用到，无需每次重新做本地时间换算与格式化。
+# 缓存为不可变元组 (秒, (yyyyMMdd, yyyy-MM-dd))，整体一次赋值替换，线程中调用时也不会读到秒与日期不一致的状态
+_date_cache: Tuple[int, Tuple[str, str]] = (-1, ("", ""))
+
+
+def _current_dates() -> Tuple[str, str]:
+    """返回当前本地日期 (yyyyMMdd, yyyy-MM-dd)"""
+    global _date_cache
+    now_sec = int(time.time())
+    cached_sec, dates = _date_cache
+    if now_sec != cached_sec:
+        now = time.localtime(now_sec)
+        dates = (time.strftime("%Y%m%d", now), time.strftime("%Y-%m-%d", now))
+        _date_cache = (now_sec, dates)
+    return dates
+
+
 class EsbRespStatus(Enum):
     """ESB 响应状态枚举"""
     SUCCESS = ("S", "成功")
@@ -114,11 +130,8 @@ class RspInfoDto:
         返回:
         str: 27位响应序列号
         """
-        # 获取当前时间
-        now = time.localtime()
-
         # 生成日期部分
-        date_part = time.strftime("%Y%m%d", now)
+        date_part = _current_dates()[0]
 
         # 获取可并发的原子序列值
         timestamp_ms, seq_val = counter.get_next()
@@ -160,7 +173,7 @@ class RspInfoDto:
         self.rsp_info["ReqSeqNum"] = req_info.get("ReqSeqNum", "")
         self.rsp_info["LegOrgId"] = req_info.get("LegOrgId", "")
         self.rsp_info["SvcStmInd"] = APP_NAME
-        self.rsp_info["SvcStmTxnDt"] = date.today().isoformat()  # LocalDate.now().toString() -> ISO 格式
+        self.rsp_info["SvcStmTxnDt"] = _current_dates()[1]  # LocalDate.now().toString() -> ISO 格式
         self.rsp_info["SvcStmRespSeqNum"] = self.generate_response_seq()
         self.rsp_info["RespSt"] = resp_st.code
         self.rsp_info["RespInfo"] = APP_NAME + resp_info_code
@@ -3,10 +3,10 @@ GitLab客户端模块
 基于PR Agent的GitLab Provider优化而来，专注于异步性能
 """
 import asyncio
-import aiohttp
 from typing import Dict, List, Optional, Tuple, Any
 import gitlab
-from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
 import logging
 import fnmatch
 
@@ -15,8 +15,18 @@ from config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+
+async def _empty_content() -> str:
+    """不需要拉取的文件版本，直接返回空内容"""
+    return ""
+
+
 class FilePatchInfo:
     """文件补丁信息 - 简化版本"""
+    # slots：每个变更文件一个实例，避免实例 __dict__ 的内存与属性访问开销
+    __slots__ = ('filename', 'old_content', 'new_content', 'patch', 'edit_type', 'old_filename',
+                 '_line_counts', '_added_lines', 'patch_token_counts')
+
     def __init__(self, filename: str, old_content: str, new_content: str, 
                  patch: str, edit_type: str, old_filename: Optional[str] = None):
         self.filename = filename
@@ -26,40 +36,113 @@ class FilePatchInfo:
         self.edit_type = edit_type
         self.old_filename = old_filename
         
-        # 计算统计信息
-        patch_lines = patch.splitlines() if patch else []
-        self.num_plus_lines = len([line for line in patch_lines if line.startswith('+')])
-        self.num_minus_lines = len([line for line in patch_lines if line.startswith('-')])
+        # 新增/删除行数只在汇总统计时使用，首次访问时再计算
+        self._line_counts: Optional[Tuple[int, int]] = None
+        self._added_lines: Optional[Tuple[str, ...]] = None
+        # 按模型缓存的patch token估算值，由AI处理器首次估算时写入
+        self.patch_token_counts: Dict[str, int] = {}
+
+    def _count_lines(self) -> Tuple[int, int]:
+        """单次遍历同时统计新增/删除行数并缓存"""
+        if self._line_counts is None:
+            num_plus_lines = 0
+            num_minus_lines = 0
+            if self.patch:
+                for line in self.patch.splitlines():
+                    if line.startswith('+'):
+                        num_plus_lines += 1
+                    elif line.startswith('-'):
+                        num_minus_lines += 1
+            self._line_counts = (num_plus_lines, num_minus_lines)
+        return self._line_counts
+
+    @property
+    def num_plus_lines(self) -> int:
+        """新增行数（含 '+++' 文件头，与原统计口径一致）"""
+        return self._count_lines()[0]
+
+    @property
+    def num_minus_lines(self) -> int:
+        """删除行数（含 '---' 文件头，与原统计口径一致）"""
+        return self._count_lines()[1]
+
+    @property
+    def added_lines(self) -> Tuple[str, ...]:
+        """新增行（保留'+'前缀，不含 '+++' 文件头），首次访问时解析并缓存，供多个检测器共用"""
+        if self._added_lines is None:
+            self._added_lines = tuple(
+                line for line in (self.patch or "").split('\n')
+                if line.startswith('+') and not line.startswith('+++')
+            )
+        return self._added_lines
 
 class GitLabClient:
     """优化的GitLab API客户端"""
+
+    # 单主机连接池大小：文件内容按10个文件并发拉取，每个文件同时请求新旧两个版本，
+    # requests 默认每主机仅保留10个连接，超出的连接用完即被丢弃，下次请求需重新握手
+    HTTP_POOL_SIZE = 32
     
     def __init__(self, gitlab_url: str, access_token: str):
         self.gitlab_url = gitlab_url.rstrip('/')
         self.access_token = access_token
-        self.gitlab = gitlab.Gitlab(gitlab_url, private_token=access_token)
-        self._cache = {}
-        self._session = None
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.HTTP_POOL_SIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self.gitlab = gitlab.Gitlab(gitlab_url, private_token=access_token, session=session)
+        # 进行中的MR请求，按 (类型, project_id, mr_id) 合并并发的相同请求；完成即移除，不跨请求保留MR数据
+        self._inflight: Dict[Tuple[str, str, int], asyncio.Future] = {}
         
     async def __aenter__(self):
-        """异步上下文管理器入口"""
-        self._session = aiohttp.ClientSession()
+        """异步上下文管理器入口（HTTP 连接池随客户端实例复用，跨多次进入保持长连接）"""
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器出口"""
-        if self._session:
-            await self._session.close()
+        return None
+
+    def close(self):
+        """关闭HTTP连接池（客户端不再使用时调用）"""
+        self.gitlab.session.close()
     
+    def _get_project(self, project_id: str):
+        """
+        获取项目对象
+
+        使用 lazy=True 只构造对象、不发起请求：后续的 MR/文件/比较接口自带项目路径，
+        项目不存在时由这些调用抛出异常，因此无需为每个文件重复 GET 项目元数据；
+        构造几乎没有开销，也无需按 project_id 缓存
+        """
+        return self.gitlab.projects.get(project_id, lazy=True)
+
+    async def _single_flight(self, key: Tuple[str, str, int], fetch) -> Any:
+        """
+        合并同一时刻的相同请求：例如审查时 MR 基本信息与 get_diff_files 内部会并发请求同一个 MR
+
+        结果在请求完成后即丢弃，保证 MR 更新后读取到最新数据
+        """
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield：某个等待方被取消时不取消共享的请求
+        return await asyncio.shield(future)
+
     async def get_mr_basic_info(self, project_id: str, mr_id: int) -> Dict[str, Any]:
-        """获取MR基本信息 - 带缓存"""
-        cache_key = f"mr_basic_{project_id}_{mr_id}"
-        if cache_key in self._cache:
-            return self._cache[cache_key]
-            
+        """获取MR基本信息 - 合并并发的相同请求"""
+        return await self._single_flight(
+            ("mr_basic", project_id, mr_id),
+            lambda: self._fetch_mr_basic_info(project_id, mr_id)
+        )
+
+    async def _fetch_mr_basic_info(self, project_id: str, mr_id: int) -> Dict[str, Any]:
+        """请求MR基本信息"""
         try:
-            project = self.gitlab.projects.get(project_id)
-            mr = project.mergerequests.get(mr_id)
+            project = self._get_project(project_id)
+            # python-gitlab 是同步客户端，放到线程中执行，避免阻塞事件循环
+            mr = await asyncio.to_thread(project.mergerequests.get, mr_id)
             
             mr_info = {
                 "id": mr.id,
@@ -80,7 +163,6 @@ class GitLabClient:
                 "diff_refs": mr.diff_refs
             }
             
-            self._cache[cache_key] = mr_info
             return mr_info
             
         except Exception as e:
@@ -88,17 +170,18 @@ class GitLabClient:
             raise
     
     async def get_mr_changes(self, project_id: str, mr_id: int) -> Dict[str, Any]:
-        """获取MR变更信息"""
-        cache_key = f"mr_changes_{project_id}_{mr_id}"
-        if cache_key in self._cache:
-            return self._cache[cache_key]
-            
+        """获取MR变更信息 - 合并并发的相同请求"""
+        return await self._single_flight(
+            ("mr_changes", project_id, mr_id),
+            lambda: self._fetch_mr_changes(project_id, mr_id)
+        )
+
+    async def _fetch_mr_changes(self, project_id: str, mr_id: int) -> Dict[str, Any]:
+        """请求MR变更信息"""
         try:
-            project = self.gitlab.projects.get(project_id)
-            mr = project.mergerequests.get(mr_id)
-            changes = mr.changes()
-            
-            self._cache[cache_key] = changes
+            project = self._get_project(project_id)
+            mr = await asyncio.to_thread(project.mergerequests.get, mr_id)
+            changes = await asyncio.to_thread(mr.changes)
             return changes
             
         except Exception as e:
@@ -106,10 +189,10 @@ class GitLabClient:
             raise
     
     async def get_file_content(self, project_id: str, file_path: str, ref: str) -> str:
-        """异步获取文件内容"""
+        """异步获取文件内容（同步的 python-gitlab 调用在线程中执行，多个文件可真正并发下载）"""
         try:
-            project = self.gitlab.projects.get(project_id)
-            file_obj = project.files.get(file_path, ref)
+            project = self._get_project(project_id)
+            file_obj = await asyncio.to_thread(project.files.get, file_path, ref)
             content = file_obj.decode()
             return content.decode('utf-8') if isinstance(content, bytes) else content
         except gitlab.GitlabGetError:
@@ -122,9 +205,11 @@ class GitLabClient:
     async def get_diff_files(self, project_id: str, mr_id: int) -> List[FilePatchInfo]:
         """获取MR的差异文件列表 - 核心功能"""
         try:
-            # 获取MR基本信息和变更
-            mr_info = await self.get_mr_basic_info(project_id, mr_id)
-            changes_data = await self.get_mr_changes(project_id, mr_id)
+            # 获取MR基本信息和变更（两者互不依赖，并发请求）
+            mr_info, changes_data = await asyncio.gather(
+                self.get_mr_basic_info(project_id, mr_id),
+                self.get_mr_changes(project_id, mr_id)
+            )
             changes = changes_data.get('changes', [])
             
             if not changes:
@@ -172,9 +257,11 @@ class GitLabClient:
         """比较两个分支并获取差异文件列表"""
         logger.info(f"Comparing branches: '{source_branch}' vs '{target_branch}'")
         try:
-            project = self.gitlab.projects.get(project_id)
+            project = self._get_project(project_id)
             # straight=True 表示我们想要两个分支端点之间的直接比较（相当于 git diff target...source）
-            comparison = project.repository_compare(from_=target_branch, to=source_branch, straight=True)
+            comparison = await asyncio.to_thread(
+                project.repository_compare, from_=target_branch, to=source_branch, straight=True
+            )
             diffs = comparison.get('diffs', [])
 
             if not diffs:
@@ -221,9 +308,15 @@ class GitLabClient:
             new_path = change.get('new_path', '')
             patch = change.get('diff', '')
             
-            # 并行获取文件内容
-            old_content_task = self.get_file_content(project_id, old_path, diff_refs['base_sha'])
-            new_content_task = self.get_file_content(project_id, new_path, diff_refs['head_sha'])
+            # 并行获取文件内容；新增文件在 base 中、删除文件在 head 中必然不存在，跳过这些注定 404 的请求
+            old_content_task = (
+                _empty_content() if change.get('new_file', False)
+                else self.get_file_content(project_id, old_path, diff_refs['base_sha'])
+            )
+            new_content_task = (
+                _empty_content() if change.get('deleted_file', False)
+                else self.get_file_content(project_id, new_path, diff_refs['head_sha'])
+            )
             
             old_content, new_content = await asyncio.gather(
                 old_content_task, new_content_task, return_exceptions=True
@@ -312,15 +405,15 @@ class GitLabClient:
                                    description: Optional[str] = None) -> bool:
         """更新MR标题和描述"""
         try:
-            project = self.gitlab.projects.get(project_id)
-            mr = project.mergerequests.get(mr_id)
+            project = self._get_project(project_id)
+            mr = await asyncio.to_thread(project.mergerequests.get, mr_id)
             
             if title:
                 mr.title = title
             if description:
                 mr.description = description
                 
-            mr.save()
+            await asyncio.to_thread(mr.save)
             return True
         except Exception as e:
             logger.error(f"Failed to update MR: {e}")
@@ -0,0 +1,44 @@
+"""
+JSON工具模块
+优先使用orjson加速解析与序列化，未安装时回退到标准库json
+"""
+import dataclasses
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，统一捕获该异常即可
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data: Any) -> Any:
+    """解析JSON字符串或bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _default(obj: Any) -> Any:
+    """标准库序列化的补充：与orjson一致地支持dataclass实例"""
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> str:
+    """序列化为紧凑JSON字符串（保留非ASCII字符），dataclass实例直接序列化，无需先转为字典"""
+    if orjson is not None:
+        # 与标准库行为保持一致：允许非字符串键（转为字符串）
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """序列化为UTF-8编码的紧凑JSON bytes，直接写入网络流时省去 str 的解码与再编码"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return dumps(obj).encode("utf-8")
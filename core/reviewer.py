@@ -45,12 +45,17 @@ class GitLabReviewer:
 
         # 审查状态追踪
         self.active_reviews = {}
+
+    def close(self):
+        """释放审查器持有的GitLab连接池"""
+        self.gitlab_client.close()
     
     async def review_file_patches(self,
                                   diff_files: List[FilePatchInfo],
                                   review_type: str = "full",
                                   mr_info: Optional[Dict] = None,
-                                  historical_issues: Optional[Dict[str, List[Dict]]] = None) -> Dict[str, Any]:
+                                  historical_issues: Optional[Dict[str, List[Dict]]] = None,
+                                  allow_batch: bool = False) -> Dict[str, Any]:
         """
         审查文件补丁列表 - 这是新的核心审查方法
 
@@ -59,6 +64,7 @@ class GitLabReviewer:
             review_type: 审查类型
             mr_info: (可选) 关联的MR信息，用于丰富报告
             historical_issues: (可选) 历史问题字典，key为文件名，value为问题列表
+            allow_batch: 是否允许走 Batch API 路径（仅后台任务开启）
 
         Returns:
             审查结果字典
@@ -71,7 +77,8 @@ class GitLabReviewer:
 
         # AI分析（传递历史问题）
         ai_analysis = await self.ai_processor.analyze_merge_request(
-            diff_files, review_type, mr_info or {}, historical_issues or {}
+            diff_files, review_type, mr_info or {}, historical_issues or {},
+            allow_batch=allow_batch
         )
 
         # 构建最终结果
@@ -84,7 +91,8 @@ class GitLabReviewer:
 
     async def review_merge_request(self, project_id: str, mr_id: int,
                                  review_type: str = "full",
-                                 options: Optional[Dict] = None) -> Dict[str, Any]:
+                                 options: Optional[Dict] = None,
+                                 allow_batch: bool = False) -> Dict[str, Any]:
         """
         审查GitLab Merge Request - 现在是 review_file_patches 的封装
         """
@@ -99,11 +107,34 @@ class GitLabReviewer:
                 raise ValueError(f"Invalid review type: {review_type}")
             
             async with self.gitlab_client:
-                mr_info = await self.gitlab_client.get_mr_basic_info(project_id, mr_id)
-                diff_files = await self.gitlab_client.get_diff_files(project_id, mr_id)
+                # MR基本信息与差异文件互不依赖，并发获取
+                mr_info, diff_files = await asyncio.gather(
+                    self.gitlab_client.get_mr_basic_info(project_id, mr_id),
+                    self.gitlab_client.get_diff_files(project_id, mr_id)
+                )
                 
                 # 调用核心审查方法
-                result = await self.review_file_patches(diff_files, review_type, mr_info)
+                result = await self.review_file_patches(
+                    diff_files, review_type, mr_info, allow_batch=allow_batch
+                )
+
+                # 服务端自动回写：评分低于阈值时直接把审查总结追加到MR描述，
+                # 省去客户端拿到结果后再把整份 review_result 回传的一次往返
+                # 回写失败不影响已完成的审查结果，仅标记 mr_updated=False
+                comment_threshold = (options or {}).get("auto_comment_threshold")
+                if comment_threshold is not None:
+                    mr_updated = False
+                    try:
+                        if result.get("score", 10.0) < float(comment_threshold):
+                            review_summary = self._generate_review_summary(result)
+                            current_description = mr_info.get("description") or ""
+                            mr_updated = await self.gitlab_client.update_mr_description(
+                                project_id, mr_id,
+                                description=f"{current_description}\n\n{review_summary}"
+                            )
+                    except Exception as e:
+                        logger.warning(f"Failed to write review summary back to MR {project_id}!{mr_id}: {e}")
+                    result.setdefault("metadata", {})["mr_updated"] = mr_updated
                 
                 # 更新状态
                 review_result.status = "completed"
@@ -124,7 +155,8 @@ class GitLabReviewer:
                                        target_branch: str, source_branch: str,
                                        review_type: str = "full",
                                        task_id: Optional[str] = None,
-                                       use_cache: bool = True) -> Dict[str, Any]:
+                                       use_cache: bool = True,
+                                       allow_batch: bool = False) -> Dict[str, Any]:
         """
         审查两个分支的比较
 
@@ -135,6 +167,7 @@ class GitLabReviewer:
             review_type: 审查类型
             task_id: 任务/工作项/开发项目号（可选），用于历史问题追踪
             use_cache: 是否使用缓存（历史问题与去重映射）
+            allow_batch: 是否允许走 Batch API 路径（仅后台任务开启）
 
         Returns:
             审查结果字典
@@ -186,11 +219,15 @@ class GitLabReviewer:
 
             # 调用核心审查方法（传递历史问题）
             result = await self.review_file_patches(
-                diff_files, review_type, comparison_info, historical_issues
+                diff_files, review_type, comparison_info, historical_issues,
+                allow_batch=allow_batch
             )
 
+            # 两次缓存写入互不依赖，并发执行
+            cache_writes = []
+
             # 缓存一次“重复审查映射”，下次同参直接复用同一个 review_id
-            if use_cache:
+            async def cache_duplicate_mapping():
                 try:
                     async with self.cache_service:
                         await self.cache_service.cache_duplicate_review(
@@ -200,7 +237,7 @@ class GitLabReviewer:
                     logger.warning(f"Failed to cache duplicate mapping: {e}")
 
             # 保存历史问题（用于下次增量审查）
-            if use_cache and result.get("findings"):
+            async def save_historical_issues():
                 try:
                     async with self.cache_service:
                         await self.cache_service.save_historical_issues(
@@ -210,6 +247,13 @@ class GitLabReviewer:
                 except Exception as e:
                     logger.warning(f"Failed to save historical issues: {e}")
 
+            if use_cache:
+                cache_writes.append(cache_duplicate_mapping())
+            if use_cache and result.get("findings"):
+                cache_writes.append(save_historical_issues())
+            if cache_writes:
+                await asyncio.gather(*cache_writes)
+
             return result
     
     async def stream_review(self, project_id: str, mr_id: int,
@@ -245,8 +289,8 @@ class GitLabReviewer:
                         "message": f"分析文件 {i+1}/{len(diff_files)}"
                     }
                     
-                    # 可以在这里添加单文件分析逻辑
-                    await asyncio.sleep(0.1)  # 模拟处理时间
+                    # 可以在这里添加单文件分析逻辑；让出事件循环以便消费者及时收到进度事件
+                    await asyncio.sleep(0)
                 
                 # 最终AI分析
                 yield {"type": "progress", "message": "AI综合分析...", "progress": 90}
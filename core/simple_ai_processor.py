@@ -3,21 +3,74 @@
 直接使用OpenAI API，避免LiteLLM的复杂性
 """
 import asyncio
+import bisect
+import functools
+import hashlib
+import importlib.util
+import itertools
 import json
 import re
+import math
 import time
-from typing import Dict, List, Optional, Any
+from collections import Counter, OrderedDict
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 # import tiktoken  # 已移除，使用简单估算替代
+import httpx
 import openai
 import logging
 
 from config.settings import settings, MODEL_COSTS, REVIEW_TYPES
+from core import json_utils
+from core.concurrency import AdaptiveConcurrencyController
 from core.gitlab_client import FilePatchInfo
 
 logger = logging.getLogger(__name__)
 
-# JSON Schema定义 - 用于结构化输出
-CODE_REVIEW_SCHEMA = {
+
+def _freeze_schema(value: Any) -> Any:
+    """把schema递归转换为只读结构（dict -> MappingProxyType, list -> tuple）"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze_schema(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze_schema(v) for v in value)
+    return value
+
+
+def _thaw_schema(value: Any) -> Any:
+    """把只读schema还原为可JSON序列化的 dict/list"""
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw_schema(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw_schema(v) for v in value]
+    return value
+
+
+# 只读schema -> 结构化输出 response_format 请求体，每个schema只构建一次
+_RESPONSE_FORMAT_CACHE: Dict[int, Dict[str, Any]] = {}
+
+
+def _json_schema_response_format(schema: Any) -> Dict[str, Any]:
+    """构建 json_schema 类型的 response_format；模块级只读schema的结果会被缓存复用"""
+    cached = _RESPONSE_FORMAT_CACHE.get(id(schema))
+    if cached is not None:
+        return cached
+
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "code_review_response",
+            "schema": _thaw_schema(schema)
+        }
+    }
+    # 只缓存只读schema，普通dict可能被修改或回收后id被复用
+    if isinstance(schema, MappingProxyType):
+        _RESPONSE_FORMAT_CACHE[id(schema)] = response_format
+    return response_format
+
+
+# JSON Schema定义 - 用于结构化输出（只读，模块加载时构建一次）
+CODE_REVIEW_SCHEMA = _freeze_schema({
     "type": "object",
     "properties": {
         "findings": {
@@ -50,9 +103,9 @@ CODE_REVIEW_SCHEMA = {
         }
     },
     "required": ["findings", "suggestions", "overall_assessment"]
-}
+})
 
-SECURITY_ANALYSIS_SCHEMA = {
+SECURITY_ANALYSIS_SCHEMA = _freeze_schema({
     "type": "object",
     "properties": {
         "is_vulnerability": {"type": "boolean", "description": "是否为安全漏洞"},
@@ -66,9 +119,35 @@ SECURITY_ANALYSIS_SCHEMA = {
         "fix_suggestion": {"type": "string", "description": "修复建议"}
     },
     "required": ["is_vulnerability", "risk_level", "description", "fix_suggestion"]
-}
+})
 
-PERFORMANCE_ANALYSIS_SCHEMA = {
+SECURITY_BATCH_ANALYSIS_SCHEMA = _freeze_schema({
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "idx": {"type": "integer", "description": "问题编号"},
+                    "is_vulnerability": {"type": "boolean", "description": "是否为安全漏洞"},
+                    "risk_level": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "maximum": 10,
+                        "description": "风险级别(1-10)"
+                    },
+                    "description": {"type": "string", "description": "详细描述"},
+                    "fix_suggestion": {"type": "string", "description": "修复建议"}
+                },
+                "required": ["idx", "is_vulnerability", "risk_level", "description", "fix_suggestion"]
+            }
+        }
+    },
+    "required": ["results"]
+})
+
+PERFORMANCE_ANALYSIS_SCHEMA = _freeze_schema({
     "type": "array",
     "items": {
         "type": "object",
@@ -84,8 +163,399 @@ PERFORMANCE_ANALYSIS_SCHEMA = {
         },
         "required": ["type", "severity", "description", "optimization"]
     }
+})
+
+SINGLE_FILE_ANALYSIS_SCHEMA = _freeze_schema({
+    "type": "object",
+    "properties": {
+        "findings": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string"},
+                    "line_number": {"type": "integer"},
+                    "severity": {"type": "string", "enum": ["high", "medium", "low"]},
+                    "description": {"type": "string"},
+                    "suggestion": {"type": "string"}
+                },
+                "required": ["type", "severity", "description"]
+            }
+        },
+        "suggestions": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": ["findings", "suggestions"]
+})
+
+# 逐文件分析完成比例达到该值时，预先基于已有结果生成全局总结
+SPECULATIVE_SUMMARY_RATIO = 0.8
+
+# 未使用服务端schema约束时，单文件响应格式错误的最大重试次数
+SINGLE_FILE_FORMAT_MAX_RETRIES = 2
+
+# 单文件分析的采样参数，实时调用、Batch API 与响应缓存键共用
+SINGLE_FILE_COMPLETION_PARAMS = MappingProxyType({"temperature": 0.2, "max_tokens": 2000})
+
+# 综合分析的输出token上限，提示词按 max_tokens_per_request 减去该值打包文件变更
+COMPREHENSIVE_OUTPUT_TOKENS = 4000
+
+# 综合分析中剩余预算不足该值时，不再截取下一个文件的片段
+COMPREHENSIVE_MIN_FILE_TOKENS = 200
+
+# 安全专项分析中每个AI请求合并的疑似问题数
+SECURITY_BATCH_SIZE = 10
+
+# 性能专项AI分析提交的问题数上限，及每个问题的输出token预算（一个含4个短字段的JSON对象）
+PERFORMANCE_AI_MAX_ISSUES = 5
+PERFORMANCE_AI_TOKENS_PER_ISSUE = 150
+
+# 评分时每个问题按严重程度的扣分（high/medium 以外的均按 low 计）
+SEVERITY_SCORE_WEIGHTS = MappingProxyType({"high": 1.0, "medium": 0.5, "low": 0.2})
+PERFORMANCE_SEVERITY_SCORE_WEIGHTS = MappingProxyType({"high": 1.5, "medium": 0.8, "low": 0.3})
+
+
+def _severity_penalty(findings: List[Dict], weights: MappingProxyType,
+                      severity_counts: Optional[Counter] = None) -> float:
+    """按严重程度计算总扣分：一次计数后与权重表做加权求和（high/medium 以外的均按 low 计）"""
+    if severity_counts is None:
+        severity_counts = Counter(finding.get("severity", "low") for finding in findings)
+    high_count = severity_counts["high"]
+    medium_count = severity_counts["medium"]
+    low_count = len(findings) - high_count - medium_count
+    return weights["high"] * high_count + weights["medium"] * medium_count + weights["low"] * low_count
+
+# 基础问题检测规则 - 合并为一个带命名分组的正则，按 lastgroup 分派
+# print\( 使用前瞻校验同一行存在右括号，不吞掉后续内容，保证同一行的TODO等标记仍能被匹配
+_BASIC_ISSUE_PATTERN = re.compile(
+    r"(?P<debug_statement>console\.log|print\((?=.*\))|System\.out\.println)"
+    r"|(?P<todo_comment>(?i:TODO|FIXME|HACK))"
+)
+
+# 超过120字符的行 - 在拼接文本上按行匹配，长度判断在C层完成，只有长行才回到Python处理
+_LONG_LINE_PATTERN = re.compile(r"^.{121,}$", re.MULTILINE)
+
+# 单文件分析的静态提示词 - 模块级常量，所有文件请求共享完全相同的前缀
+SINGLE_FILE_SYSTEM_MESSAGE = "你是一个专业的代码审查专家，专注于单文件代码分析。"
+
+_SINGLE_FILE_REGULAR_INSTRUCTIONS = """
+📋 **审查模式：常规代码审查**
+
+**分析要求**：
+1. **避免重复发现**：对于同一个根本问题，合并到一个 finding
+2. **合并相关问题**：同一代码行的多个问题整合为一个描述
+3. **聚焦关键问题**：只报告对代码功能和质量有重大影响的问题（0-3个）
+4. **只审查 diff**：只关注 diff 部分的变更，不要审查整个文件内容
+5. **无伤大雅的问题不报告**：代码风格、注释建议等小问题不要报告
+
+注意：这是单文件分析。
+"""
+
+_SINGLE_FILE_HISTORY_INSTRUCTIONS = """
+🔴 **审查模式：历史问题追踪模式**
+
+**审查要求（历史问题模式）**：
+1. **只看历史问题区域**：仅检查下述历史问题所在的代码行及其周边代码在本次 diff 中的修改情况
+2. **判断修复状态**：
+   - 如果问题已修复且没引入新的严重bug → findings 返回空数组 []
+   - 如果问题未修复或修复不当 → findings 中报告该历史问题
+   - 如果引入了严重的新问题（如安全漏洞）→ findings 中报告新问题
+3. **严格限制新问题**：不要审查与历史问题无关的代码，不要报告小问题或建议性问题
+4. **目标**：帮助开发者确认历史问题是否已修复，而不是发现新问题
+
+注意：这是单文件分析。 ⚠️ 本次是历史问题追踪，如果历史问题都已修复，请返回空的 findings: []
+"""
+
+_SINGLE_FILE_JSON_FORMAT_INSTRUCTIONS = """
+⚠️ 重要：请严格按照以下JSON格式回复，不要添加任何其他文本、解释或markdown标记：
+
+{
+    "findings": [
+        {
+            "type": "问题类型",
+            "line_number": 行号,
+            "severity": "high/medium/low",
+            "description": "完整的问题描述（如果同一行有多个相关问题，请合并描述）",
+            "suggestion": "综合的修复建议"
+        }
+    ],
+    "suggestions": ["改进建议1", "改进建议2"]
 }
 
+格式要求：
+1. 输出必须是有效的JSON格式
+2. 不要用```json或其他代码块包装
+3. 不要添加任何解释文字
+4. 确保所有字符串都用双引号包围
+5. 确保同一行或相关的问题只生成一个finding对象
+"""
+
+# 历史问题追踪提示的固定头部与强制要求（问题清单按文件拼接在两者之间）
+_HISTORICAL_CONTEXT_HEADER = (
+    "\n\n🔴 **重要：本次审查为历史问题追踪模式**\n\n"
+    "⚠️ **上一次审查发现的问题清单**：\n\n"
+)
+_HISTORICAL_CONTEXT_REQUIREMENTS = (
+    "\n🎯 **强制审查要求（极其重要）**：\n"
+    "1. **仅关注历史问题**：只检查上述历史问题相关的代码区域是否有修改\n"
+    "2. **检查修复状态**：对每个历史问题，判断本次 diff 中是否已修复\n"
+    "3. **修复即清除**：如果历史问题已被正确修复且没有引入新的严重问题，返回空 findings []\n"
+    "4. **问题持续**：如果历史问题仍然存在（代码未改或改得不对），在 findings 中报告\n"
+    "5. **新问题严格限制**：除非是严重影响生产的新问题（如安全漏洞、崩溃风险），否则不要报告新问题\n"
+    "6. **不要报告其他代码**：不要审查与历史问题无关的代码区域\n\n"
+    "💡 **理想结果**：如果开发者正确修复了所有历史问题，你应该返回 findings: []\n\n"
+)
+
+def _content_digest(*parts: str) -> str:
+    """计算缓存/去重用的内容摘要（BLAKE2b，仅用于缓存键，不用于安全场景）"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\x00")
+    return hasher.hexdigest()
+
+
+class ResponseCache:
+    """进程内AI响应缓存 - 按内容摘要缓存原始响应，LRU淘汰 + TTL过期"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# 单文件分析响应缓存：相同模型 + 相同提示词（即相同文件内容与审查模式）直接复用上次的响应
+_single_file_response_cache = ResponseCache(
+    max_size=settings.ai_response_cache_size,
+    ttl_seconds=settings.ai_response_cache_ttl
+)
+
+
+# 安全分析结论缓存：相同模型 + 相同问题类别 + 相同代码行直接复用上次的结论
+_security_analysis_cache = ResponseCache(
+    max_size=settings.security_analysis_cache_size,
+    ttl_seconds=settings.ai_response_cache_ttl
+)
+
+
+# 响应JSON提取：raw_decode 在C层完成解析并给出结束位置；```json 代码块用预编译正则提取
+_JSON_DECODER = json.JSONDecoder()
+_JSON_CODE_BLOCK_PATTERN = re.compile(r"```json(.*?)```", re.DOTALL)
+
+
+def _raw_decode_json_object(text: str, start: int) -> Optional[str]:
+    """从 start 处解析一个完整的JSON值，成功时返回其原文，不合法时返回 None"""
+    try:
+        _, end = _JSON_DECODER.raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return text[start:end]
+
+
+# JSON结构扫描：字符串整体作为一个token跳过（含转义，未闭合时吞到文本末尾），只有括号回到Python层计数
+_JSON_STRUCTURE_TOKEN_PATTERN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(?:"|\\?\Z)|[{}]', re.DOTALL)
+
+
+def _find_json_object_end(text: str, start: int) -> int:
+    """从 start 处的 { 开始扫描，返回与之匹配的 } 的位置，未闭合时返回 -1
+
+    字符串内的括号不计入深度；逐字符的状态判断由正则在C层完成，不复制原文本。
+    """
+    depth = 0
+    for match in _JSON_STRUCTURE_TOKEN_PATTERN.finditer(text, start):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return match.start()
+    return -1
+
+
+# 常见JSON格式问题的修复规则（模块加载时编译一次，按顺序依次应用）
+_JSON_OBJECT_SPAN_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+_JSON_FIX_RULES = tuple((re.compile(pattern), replacement) for pattern, replacement in (
+    (r"'([^']*)':", r'"\1":'),         # 'key': -> "key":
+    (r":\s*'([^']*)'", r': "\1"'),    # : 'value' -> : "value"
+    (r'(\w+):', r'"\1":'),            # 未引用的键名
+    (r',\s*}', '}'),                  # 尾随逗号
+    (r',\s*]', ']'),
+))
+_FINDINGS_ARRAY_PATTERN = re.compile(r'"findings"\s*:\s*\[(.*?)\]', re.DOTALL)
+_SUGGESTIONS_ARRAY_PATTERN = re.compile(r'"suggestions"\s*:\s*\[(.*?)\]', re.DOTALL)
+
+
+
+def _compile_rules(rules: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """把每个规则的多个正则合并为一个忽略大小写的 re.Pattern（任一匹配即命中）"""
+    return {
+        name: {**config, "pattern": re.compile("|".join(f"(?:{p})" for p in config["patterns"]), re.IGNORECASE)}
+        for name, config in rules.items()
+    }
+
+
+def _union_pattern(rules: Dict[str, Dict[str, Any]]) -> re.Pattern:
+    """所有规则合并成的预筛选正则：不匹配的行直接跳过，匹配的行再逐个规则精确判断
+
+    预筛选在多行拼接的整段文本上执行，\\s 替换为不含换行的空白，保证匹配不会跨行。
+    """
+    union = "|".join(f"(?:{config['pattern'].pattern})" for config in rules.values())
+    return re.compile(union.replace(r"\s", r"[^\S\n]"), re.IGNORECASE)
+
+
+# 规则扫描的单行长度上限：`for.*in.*for.*in` 等规则在回溯引擎上是多项式复杂度，
+# 超长行（压缩代码、恶意构造的diff）只扫描前 4KB，避免单个MR长时间占用工作线程
+MAX_SCAN_LINE_LENGTH = 4096
+
+
+def _scannable_lines(lines: Sequence[str]) -> Sequence[str]:
+    """超长行截断到 MAX_SCAN_LINE_LENGTH；没有超长行时直接返回原序列，不复制"""
+    if not lines or max(map(len, lines)) <= MAX_SCAN_LINE_LENGTH:
+        return lines
+    return [line[:MAX_SCAN_LINE_LENGTH] for line in lines]
+
+
+def _candidate_line_indexes(prefilter: re.Pattern, lines: Sequence[str],
+                            trigger: Optional[re.Pattern] = None) -> List[int]:
+    """对所有行拼接后的文本做一次预筛选扫描，返回存在匹配的行下标（升序）
+
+    trigger 为规则命中的必要字符集：不含其中任何字符的行（空行、纯标识符等）不参与扫描。
+    """
+    if trigger is None:
+        line_indexes: Sequence[int] = range(len(lines))
+    else:
+        has_trigger = trigger.search
+        line_indexes = [i for i, line in enumerate(lines) if has_trigger(line)]
+        lines = [lines[i] for i in line_indexes]
+    if not lines:
+        return []
+    line_starts = list(itertools.accumulate((len(line) + 1 for line in lines[:-1]), initial=0))
+    candidates = []
+    for match in prefilter.finditer("\n".join(lines)):
+        line_index = line_indexes[bisect.bisect_right(line_starts, match.start()) - 1]
+        if not candidates or candidates[-1] != line_index:
+            candidates.append(line_index)
+    return candidates
+
+
+# 安全问题检测规则 - 模块加载时预编译
+_SECURITY_RULES = _compile_rules({
+    "sql_injection": {
+        "patterns": [r"execute\(.*\+.*\)", r"query\(.*\+.*\)", r"SELECT.*\+"],
+        "description": "可能存在SQL注入风险，检测到字符串拼接构建SQL查询",
+        "suggestion": "使用参数化查询或预编译语句防止SQL注入"
+    },
+    "xss": {
+        "patterns": [r"innerHTML\s*=", r"document\.write\(", r"eval\("],
+        "description": "可能存在跨站脚本(XSS)风险，检测到直接操作DOM或执行动态代码",
+        "suggestion": "对用户输入进行转义，使用安全的DOM操作方法"
+    },
+    "hardcoded_secrets": {
+        "patterns": [r"password\s*=\s*['\"]", r"api[_-]?key\s*=\s*['\"]", r"secret\s*=\s*['\"]"],
+        "description": "检测到硬编码的敏感信息，存在安全泄露风险",
+        "suggestion": "将敏感信息存储在环境变量或安全的配置管理系统中"
+    },
+    "path_traversal": {
+        "patterns": [r"\.\.\/", r"\.\.\\\\", r"os\.path\.join.*\.\."],
+        "description": "可能存在路径穿越风险，检测到相对路径操作",
+        "suggestion": "验证和清理文件路径，使用绝对路径或安全的路径处理方法"
+    },
+    "command_injection": {
+        "patterns": [r"os\.system\(", r"subprocess\.", r"exec\(", r"shell=True"],
+        "description": "可能存在命令注入风险，检测到系统命令执行",
+        "suggestion": "避免执行用户输入的命令，使用参数化的命令执行或白名单验证"
+    }
+})
+_SECURITY_PREFILTER = _union_pattern(_SECURITY_RULES)
+# 每条安全规则都包含 ( = . + 之一的字面字符，缺少这些字符的行不可能命中（新增规则时需同步维护）
+_SECURITY_TRIGGER = re.compile(r"[(=.+]")
+
+# 性能问题检测规则 - 模块加载时预编译
+_PERFORMANCE_RULES = _compile_rules({
+    "n_plus_1_query": {
+        "patterns": [r"for.*in.*:", r"\.get\(", r"\.filter\("],
+        "description": "可能存在N+1查询问题，在循环中进行数据库查询"
+    },
+    "inefficient_loop": {
+        "patterns": [r"for.*in.*for.*in", r"while.*while"],
+        "description": "检测到嵌套循环，可能存在性能问题"
+    },
+    "memory_leak": {
+        "patterns": [r"\.append\(", r"global\s+", r"cache\["],
+        "description": "可能存在内存泄漏风险，检测到持续增长的数据结构"
+    },
+    "blocking_io": {
+        "patterns": [r"requests\.get", r"urllib\.request", r"time\.sleep"],
+        "description": "检测到阻塞I/O操作，可能影响性能"
+    },
+    "inefficient_data_structure": {
+        "patterns": [r"list\(\)", r"dict\(\)", r"\[\].*in.*for"],
+        "description": "可能使用了低效的数据结构或操作"
+    }
+})
+_PERFORMANCE_PREFILTER = _union_pattern(_PERFORMANCE_RULES)
+
+# 提示词前缀摘要 -> 预热任务；同一前缀只预热一次，并发请求共享同一个预热任务
+_prompt_prefix_warmups: Dict[str, "asyncio.Future"] = {}
+
+
+# 代码文本检测规则 - 模块加载时合并编译为一个正则，避免每次估算token时逐条匹配
+_CODE_DETECTION_PATTERN = re.compile("|".join(f"(?:{pattern})" for pattern in (
+    r'def\s+\w+\s*\(',      # Python函数定义
+    r'class\s+\w+',         # 类定义
+    r'function\s*\(',       # JavaScript函数
+    r'import\s+\w+',        # 导入语句
+    r'from\s+\w+\s+import', # Python导入
+    r'{\s*$',               # 代码块开始
+    r'}\s*$',               # 代码块结束
+    r'if\s*\(',             # 条件语句
+    r'for\s*\(',            # 循环语句
+    r'while\s*\(',          # while循环
+)), re.MULTILINE)
+
+_CHINESE_CHAR_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
+
+@functools.lru_cache(maxsize=32)
+def _char_token_ratio_for_model(model: str) -> float:
+    """根据模型名获取字符-token比例"""
+    model_lower = model.lower()
+
+    # 检查模型名中是否包含已知模型类型
+    for model_type, ratio in TokenManager.CHAR_TOKEN_RATIOS.items():
+        if model_type in model_lower:
+            return ratio
+
+    # 如果是中文相关的模型，使用更高的比例
+    chinese_indicators = ['chinese', 'zh', 'cn', 'baichuan', 'internlm']
+    if any(indicator in model_lower for indicator in chinese_indicators):
+        return 4.5
+
+    return TokenManager.CHAR_TOKEN_RATIOS['default']
+
+
 class TokenManager:
     """Token管理器 - 使用简单估算，不依赖tiktoken"""
     
@@ -108,20 +578,8 @@ class TokenManager:
         logger.info(f"TokenManager initialized for model '{self.model}' with ratio {self.ratio}")
     
     def _get_ratio_for_model(self, model: str) -> float:
-        """根据模型名获取字符-token比例"""
-        model_lower = model.lower()
-        
-        # 检查模型名中是否包含已知模型类型
-        for model_type, ratio in self.CHAR_TOKEN_RATIOS.items():
-            if model_type in model_lower:
-                return ratio
-        
-        # 如果是中文相关的模型，使用更高的比例
-        chinese_indicators = ['chinese', 'zh', 'cn', 'baichuan', 'internlm']
-        if any(indicator in model_lower for indicator in chinese_indicators):
-            return 4.5
-            
-        return self.CHAR_TOKEN_RATIOS['default']
+        """根据模型名获取字符-token比例（结果在所有实例间共享缓存）"""
+        return _char_token_ratio_for_model(model)
     
     def count_tokens(self, text: str) -> int:
         """计算文本token数量 - 基于字符数的简单估算"""
@@ -140,28 +598,15 @@ class TokenManager:
     
     def _adjust_ratio_for_content(self, text: str, base_ratio: float) -> float:
         """根据文本内容调整字符-token比例"""
-        # 检测是否是代码文本
-        code_patterns = [
-            r'def\s+\w+\s*\(',      # Python函数定义
-            r'class\s+\w+',         # 类定义
-            r'function\s*\(',       # JavaScript函数
-            r'import\s+\w+',        # 导入语句
-            r'from\s+\w+\s+import', # Python导入
-            r'{\s*$',               # 代码块开始
-            r'}\s*$',               # 代码块结束
-            r'if\s*\(',             # 条件语句
-            r'for\s*\(',            # 循环语句
-            r'while\s*\(',          # while循环
-        ]
-        
-        is_code = any(re.search(pattern, text, re.MULTILINE) for pattern in code_patterns)
+        # 检测是否是代码文本（预编译的合并正则，一次扫描）
+        is_code = _CODE_DETECTION_PATTERN.search(text) is not None
         
         if is_code:
             # 代码文本通常token密度更高（更多符号和关键字）
             return base_ratio * 0.75
         
         # 检测是否包含大量中文
-        chinese_char_count = len(re.findall(r'[\u4e00-\u9fff]', text))
+        chinese_char_count = len(_CHINESE_CHAR_PATTERN.findall(text))
         chinese_ratio = chinese_char_count / len(text) if text else 0
         
         if chinese_ratio > 0.3:  # 超过30%中文字符
@@ -169,18 +614,144 @@ class TokenManager:
             return base_ratio * 1.2
         
         return base_ratio
-    
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """批量计算多段文本的token数量，返回与输入顺序一致的列表"""
+        count = self.count_tokens
+        return [count(text) for text in texts]
+
     def estimate_cost(self, input_tokens: int, output_tokens: int = 1000) -> float:
         """估算API调用成本"""
         costs = MODEL_COSTS.get(self.model, {"input": 0.01, "output": 0.03})
         return (input_tokens * costs["input"] + output_tokens * costs["output"]) / 1000
 
+# OpenAI GPT-4 和 GPT-3.5-turbo 的较新版本支持结构化输出
+# DeepSeek 和其他现代模型也支持结构化输出
+_STRUCTURED_OUTPUT_MODEL_PREFIXES = (
+    "gpt-4o", "gpt-4o-mini", "gpt-4-turbo",
+    "gpt-4", "gpt-3.5-turbo",
+    "deepseek", "claude", "gemini"  # 添加更多模型支持
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _supports_structured_output(model: str, enable_structured_output: bool,
+                                require_server_side_schema: bool,
+                                force_structured_output: bool) -> bool:
+    """检查模型是否支持结构化输出（纯函数，按模型与配置缓存结果）"""
+    # 首先检查全局配置
+    if not enable_structured_output:
+        return False
+
+    # 不要求服务端schema校验时，改用提示词约束 + 客户端校验重试
+    if not require_server_side_schema:
+        return False
+
+    # 如果强制启用，直接返回True；否则检查是否为支持的模型
+    return force_structured_output or model.startswith(_STRUCTURED_OUTPUT_MODEL_PREFIXES)
+
+
+class StreamingFindingsParser:
+    """流式响应的增量 findings 解析器
+
+    逐块接收模型输出，跟踪字符串/转义状态与括号深度，在 findings 数组中每个对象的
+    右括号到达时立即解析出该 finding，无需等待完整JSON。
+    """
+
+    _FINDINGS_KEY = re.compile(r'"findings"\s*:\s*\[')
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._object_start = -1
+        self.findings: List[Dict] = []
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """追加一段输出，返回本次新解析出的 findings"""
+        if self._done or not chunk:
+            return []
+        self._text += chunk
+
+        if not self._in_array:
+            match = self._FINDINGS_KEY.search(self._text)
+            if not match:
+                return []
+            self._in_array = True
+            self._pos = match.end()
+
+        new_findings = []
+        text = self._text
+        pos = self._pos
+        while pos < len(text):
+            char = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._object_start = pos
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._object_start >= 0:
+                    try:
+                        finding = json_utils.loads(text[self._object_start:pos + 1])
+                        if isinstance(finding, dict):
+                            new_findings.append(finding)
+                    except json_utils.JSONDecodeError:
+                        pass
+                    self._object_start = -1
+            elif char == "]" and self._depth == 0:
+                self._done = True
+                pos += 1
+                break
+            pos += 1
+        self._pos = pos
+
+        self.findings.extend(new_findings)
+        return new_findings
+
+# 按 (api_key, base_url) 共享的底层 AsyncOpenAI 客户端：每次审查都会新建 SimpleAIProcessor，
+# 共享后所有审查复用同一个HTTP连接池，不必为每次审查重新建立 TCP/TLS 连接
+_shared_openai_clients: Dict[Tuple[str, Optional[str]], Any] = {}
+
+
+async def close_shared_openai_clients():
+    """关闭所有共享的 AsyncOpenAI 客户端（应用关闭时调用）"""
+    clients = list(_shared_openai_clients.values())
+    _shared_openai_clients.clear()
+    for client in clients:
+        try:
+            await client.close()
+        except Exception as e:
+            # 忽略关闭时的错误，避免影响应用退出
+            logger.warning(f"Error closing OpenAI client (ignored): {e}")
+    if clients:
+        logger.info(f"Closed {len(clients)} shared OpenAI client(s)")
+
+
 class SimpleOpenAIClient:
     """简化的OpenAI客户端 - 最小化初始化参数避免版本兼容问题"""
     
     def __init__(self, api_key: str, base_url: Optional[str] = None):
         if not api_key:
             raise ValueError("API key is required")
+
+        shared_key = (api_key, base_url)
+        self.client = _shared_openai_clients.get(shared_key)
+        if self.client is not None:
+            return
             
         try:
             # 使用最基本的参数进行初始化，避免版本兼容问题
@@ -193,6 +764,10 @@ class SimpleOpenAIClient:
             if base_url:
                 client_kwargs["base_url"] = base_url
                 logger.info(f"OpenAI client initializing with custom base URL: {base_url}")
+
+            http_client = self._build_http_client()
+            if http_client is not None:
+                client_kwargs["http_client"] = http_client
             
             self.client = openai.AsyncOpenAI(**client_kwargs)
             logger.info("OpenAI client initialized successfully")
@@ -212,56 +787,80 @@ class SimpleOpenAIClient:
                     raise RuntimeError(f"Cannot initialize OpenAI client: {e2}")
             else:
                 raise RuntimeError(f"Cannot initialize OpenAI client: {e}")
+
+        _shared_openai_clients[shared_key] = self.client
+
+    @staticmethod
+    def _build_http_client() -> Optional[httpx.AsyncClient]:
+        """
+        构建连接池按并发数调优的HTTP客户端；安装了h2时启用HTTP/2多路复用
+
+        连接池由所有审查共享，按单次审查的逐文件并发数乘以最大并发审查数确定大小
+        """
+        pool_size = max(settings.max_concurrent_file_reviews * 2, 10) * max(settings.max_concurrent_reviews, 1)
+        http2 = importlib.util.find_spec("h2") is not None
+        try:
+            http_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=60.0
+                ),
+                timeout=httpx.Timeout(60.0, connect=10.0)
+            )
+        except Exception as e:
+            # 构建失败时使用SDK默认的HTTP客户端
+            logger.warning(f"Failed to build tuned HTTP client, using SDK default: {e}")
+            return None
+
+        logger.info(f"HTTP client pool size: {pool_size}, HTTP/2: {http2}")
+        return http_client
     
     async def chat_completion(self, messages: List[Dict], model: str, 
-                            response_format: Optional[Dict] = None, **kwargs) -> str:
-        """发送聊天完成请求 - 带详细日志记录"""
-        import time
-        
+                            response_format: Optional[Dict] = None,
+                            concurrency_controller: Optional[AdaptiveConcurrencyController] = None,
+                            **kwargs) -> str:
+        """
+        发送聊天完成请求 - 带详细日志记录（仅在INFO级别启用时构建详细日志）
+
+        concurrency_controller 为调用方的自适应并发控制器，按调用传入，用于上报延迟与限流情况
+        """
         # 记录请求开始时间
-        start_time = time.time()
-        
-        # 计算输入token数量
-        input_text = "\n".join([msg.get('content', '') for msg in messages])
-        input_tokens = len(input_text) // 4  # 简单估算
-        
-        # 记录请求参数详情
-        logger.info("=" * 60)
-        logger.info("🚀 OpenAI API 调用开始")
-        logger.info("=" * 60)
-        logger.info(f"📋 请求参数:")
-        logger.info(f"  - 模型: {model}")
-        logger.info(f"  - 消息数量: {len(messages)}")
-        logger.info(f"  - 估算输入tokens: {input_tokens}")
-        logger.info(f"  - 额外参数: {kwargs}")
-        
-        # 记录消息内容（可选择性记录）
-        logger.info(f"💬 消息内容:")
-        for i, msg in enumerate(messages):
-            role = msg.get('role', 'unknown')
-            content = msg.get('content', '')[:200] + '...' if len(msg.get('content', '')) > 200 else msg.get('content', '')
-            logger.info(f"  [{i+1}] {role}: {content}")
+        start_time = time.perf_counter()
+        verbose = logger.isEnabledFor(logging.INFO)
+        
+        if verbose:
+            # 计算输入token数量
+            input_tokens = sum(len(msg.get('content', '')) for msg in messages) // 4  # 简单估算
+
+            # 记录请求参数详情
+            logger.info("=" * 60)
+            logger.info("🚀 OpenAI API 调用开始")
+            logger.info("=" * 60)
+            logger.info("📋 请求参数:")
+            logger.info("  - 模型: %s", model)
+            logger.info("  - 消息数量: %d", len(messages))
+            logger.info("  - 估算输入tokens: %d", input_tokens)
+            logger.info("  - 额外参数: %s", kwargs)
+
+            # 记录消息内容（最多记录前10条，每条截取200字符）
+            logger.info("💬 消息内容:")
+            for i, msg in enumerate(itertools.islice(messages, 10)):
+                content = msg.get('content', '')
+                if len(content) > 200:
+                    content = content[:200] + '...'
+                logger.info("  [%d] %s: %s", i + 1, msg.get('role', 'unknown'), content)
         
         try:
             # 发送API请求
             logger.info("⏳ 正在调用OpenAI API...")
             
             # 构建API调用参数
-            api_params = {
-                "model": model,
-                "messages": messages,
-                **kwargs
-            }
+            api_params = self._build_api_params(messages, model, response_format, **kwargs)
             
             # 如果支持结构化输出，添加response_format
-            if response_format and self._supports_structured_output(model):
-                api_params["response_format"] = {
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "code_review_response",
-                        "schema": response_format
-                    }
-                }
+            if "response_format" in api_params:
                 logger.info("🎯 使用结构化输出模式")
             elif response_format:
                 logger.info("📝 模型不支持结构化输出，使用提示词约束")
@@ -269,48 +868,55 @@ class SimpleOpenAIClient:
             response = await self.client.chat.completions.create(**api_params)
             
             # 计算响应时间
-            end_time = time.time()
+            end_time = time.perf_counter()
             response_time = end_time - start_time
             
+            if concurrency_controller is not None:
+                concurrency_controller.record_success(response_time)
+            
             # 获取响应内容
             response_content = response.choices[0].message.content
-            response_tokens = len(response_content) // 4  # 简单估算
-            
-            # 记录响应详情
-            logger.info("=" * 60)
-            logger.info("✅ OpenAI API 调用成功")
-            logger.info("=" * 60)
-            logger.info(f"⏱️  响应时间: {response_time:.2f}秒")
-            logger.info(f"📊 Token使用情况:")
             
-            # 尝试获取实际token使用量（如果API返回了）
-            if hasattr(response, 'usage') and response.usage:
-                logger.info(f"  - 输入tokens: {response.usage.prompt_tokens}")
-                logger.info(f"  - 输出tokens: {response.usage.completion_tokens}")
-                logger.info(f"  - 总tokens: {response.usage.total_tokens}")
-            else:
-                logger.info(f"  - 估算输入tokens: {input_tokens}")
-                logger.info(f"  - 估算输出tokens: {response_tokens}")
-                
-            logger.info(f"🎯 响应内容:")
-            # 记录完整响应内容，但如果太长则截取
-            if len(response_content) > 2000:
-                logger.info(f"  {response_content[:800]}...")
-                logger.info(f"  ... [中间省略 {len(response_content)-1600} 个字符] ...")
-                logger.info(f"  ...{response_content[-800:]}")
-            else:
-                logger.info(f"  {response_content}")
+            if verbose:
+                # 记录响应详情
+                logger.info("=" * 60)
+                logger.info("✅ OpenAI API 调用成功")
+                logger.info("=" * 60)
+                logger.info("⏱️  响应时间: %.2f秒", response_time)
+                logger.info("📊 Token使用情况:")
+
+                # 尝试获取实际token使用量（如果API返回了）
+                if hasattr(response, 'usage') and response.usage:
+                    logger.info("  - 输入tokens: %s", response.usage.prompt_tokens)
+                    logger.info("  - 输出tokens: %s", response.usage.completion_tokens)
+                    logger.info("  - 总tokens: %s", response.usage.total_tokens)
+                else:
+                    logger.info("  - 估算输入tokens: %d", input_tokens)
+                    logger.info("  - 估算输出tokens: %d", len(response_content) // 4)
+
+                logger.info("🎯 响应内容:")
+                # 记录完整响应内容，但如果太长则截取
+                if len(response_content) > 2000:
+                    logger.info("  %s...", response_content[:800])
+                    logger.info("  ... [中间省略 %d 个字符] ...", len(response_content) - 1600)
+                    logger.info("  ...%s", response_content[-800:])
+                else:
+                    logger.info("  %s", response_content)
+
+                logger.info("=" * 60)
             
             # 为调试目的，记录响应的前1000个字符到DEBUG级别
-            logger.debug(f"Full response preview: {response_content[:1000]}")
-            
-            logger.info("=" * 60)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Full response preview: %s", response_content[:1000])
             
             return response_content
             
         except Exception as e:
-            end_time = time.time()
+            end_time = time.perf_counter()
             response_time = end_time - start_time
+
+            if concurrency_controller is not None and isinstance(e, openai.RateLimitError):
+                concurrency_controller.record_rate_limited()
             
             logger.error("=" * 60)
             logger.error("❌ OpenAI API 调用失败")
@@ -321,17 +927,147 @@ class SimpleOpenAIClient:
             logger.error("=" * 60)
             raise
     
-    async def close(self):
-        """安全关闭客户端，避免状态错误"""
+    async def chat_completion_stream(self, messages: List[Dict], model: str,
+                                     response_format: Optional[Dict] = None,
+                                     findings_parser: Optional[StreamingFindingsParser] = None,
+                                     concurrency_controller: Optional[AdaptiveConcurrencyController] = None,
+                                     **kwargs) -> Tuple[str, bool]:
+        """流式聊天完成请求
+
+        边接收边累积增量内容，并把每个分块交给 findings_parser 增量解析；
+        即使最终内容被截断或JSON不完整，已解析出的 findings 仍可从解析器中取得。
+
+        Returns:
+            (响应内容, 是否完整)：流在中途出错时返回已接收的部分内容，完整标记为 False
+        """
+        start_time = time.perf_counter()
+        api_params = self._build_api_params(messages, model, response_format, **kwargs)
+        logger.info(f"🚀 OpenAI API 流式调用开始 (模型: {model}, 消息数量: {len(messages)})")
+
+        chunks = []
+        complete = True
         try:
-            if hasattr(self, 'client') and self.client:
-                # 检查客户端是否有close方法且可以安全调用
-                if hasattr(self.client, 'close'):
-                    await self.client.close()
-                    logger.info("OpenAI client closed successfully")
+            stream = await self.client.chat.completions.create(stream=True, **api_params)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                chunks.append(delta)
+                if findings_parser is not None:
+                    findings_parser.feed(delta)
         except Exception as e:
-            # 忽略关闭时的错误，避免影响主要功能
-            logger.warning(f"Error closing OpenAI client (ignored): {e}")
+            logger.error(f"❌ OpenAI API 流式调用失败 ({time.perf_counter() - start_time:.2f}秒): {e}")
+            if concurrency_controller is not None and isinstance(e, openai.RateLimitError):
+                concurrency_controller.record_rate_limited()
+            if not chunks:
+                raise
+            # 已收到部分内容时返回已累积内容，由调用方结合增量解析结果处理
+            logger.warning(f"流式响应中断，使用已接收的 {len(chunks)} 个分块")
+            complete = False
+
+        response_content = "".join(chunks)
+        # 中途失败的调用不计为成功，避免自适应并发在出错时反而提升并发
+        if concurrency_controller is not None and complete:
+            concurrency_controller.record_success(time.perf_counter() - start_time)
+        logger.info(f"✅ OpenAI API 流式调用{'完成' if complete else '中断'}，"
+                    f"耗时: {time.perf_counter() - start_time:.2f}秒，响应长度: {len(response_content)}")
+        logger.debug(f"Full response preview: {response_content[:1000]}")
+        return response_content, complete
+
+    def _build_api_params(self, messages: List[Dict], model: str,
+                          response_format: Optional[Dict] = None, **kwargs) -> Dict[str, Any]:
+        """构建聊天完成请求参数，实时调用与Batch API共用"""
+        api_params = {
+            "model": model,
+            "messages": messages,
+            **kwargs
+        }
+
+        # 如果支持结构化输出，添加response_format
+        if response_format and self._supports_structured_output(model):
+            api_params["response_format"] = _json_schema_response_format(response_format)
+        return api_params
+
+    async def batch_chat_completions(self, requests: Dict[str, Dict[str, Any]],
+                                     poll_interval: float = 5.0,
+                                     max_wait_seconds: float = 3600.0) -> Dict[str, str]:
+        """通过OpenAI Batch API批量提交聊天完成请求
+
+        Args:
+            requests: custom_id -> 请求参数（由 _build_api_params 构建）
+            poll_interval: 初始轮询间隔（秒），按指数退避递增
+            max_wait_seconds: 最长等待时间，超时后取消批处理并抛出 TimeoutError
+
+        Returns:
+            custom_id -> 响应内容，仅包含成功的请求
+        """
+        start_time = time.perf_counter()
+        jsonl_lines = [
+            json_utils.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            })
+            for custom_id, body in requests.items()
+        ]
+        batch_input = ("\n".join(jsonl_lines) + "\n").encode("utf-8")
+
+        input_file = await self.client.files.create(
+            file=("batch_input.jsonl", batch_input),
+            purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"📦 Batch任务已提交: {batch.id}，请求数: {len(requests)}")
+
+        # 指数退避轮询批处理状态
+        interval = poll_interval
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            if time.perf_counter() - start_time > max_wait_seconds:
+                try:
+                    await self.client.batches.cancel(batch.id)
+                except Exception as e:
+                    logger.warning(f"取消Batch任务失败 (ignored): {e}")
+                raise TimeoutError(f"Batch任务 {batch.id} 等待超时 ({max_wait_seconds:.0f}秒)")
+
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, 60.0)
+            batch = await self.client.batches.retrieve(batch.id)
+            logger.debug(f"Batch {batch.id} status: {batch.status}")
+
+        if batch.status != "completed" or not batch.output_file_id:
+            raise RuntimeError(f"Batch任务 {batch.id} 未成功完成，状态: {batch.status}")
+
+        output = await self.client.files.content(batch.output_file_id)
+        results = {}
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            item = json_utils.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                logger.warning(f"Batch请求 {item.get('custom_id')} 失败: {item.get('error') or response.get('status_code')}")
+                continue
+            results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+        logger.info(f"📦 Batch任务完成: {batch.id}，成功 {len(results)}/{len(requests)}，"
+                    f"耗时 {time.perf_counter() - start_time:.2f}秒")
+        return results
+
+    async def close(self):
+        """
+        释放客户端引用
+
+        底层 AsyncOpenAI 客户端与连接池由所有审查共享，这里不关闭，
+        进程退出时由 close_shared_openai_clients 统一关闭
+        """
+        logger.debug("SimpleOpenAIClient.close() called (client is shared, not closing)")
     
     def __del__(self):
         """析构函数，确保资源清理"""
@@ -344,29 +1080,12 @@ class SimpleOpenAIClient:
     
     def _supports_structured_output(self, model: str) -> bool:
         """检查模型是否支持结构化输出"""
-        # 首先检查全局配置
-        if not settings.enable_structured_output:
-            return False
-        
-        # 如果强制启用，直接返回True
-        if settings.force_structured_output:
-            return True
-        
-        # OpenAI GPT-4 和 GPT-3.5-turbo 的较新版本支持结构化输出
-        # DeepSeek 和其他现代模型也支持结构化输出
-        supported_models = [
-            "gpt-4o", "gpt-4o-mini", "gpt-4-turbo", 
-            "gpt-4", "gpt-3.5-turbo",
-            "deepseek", "claude", "gemini"  # 添加更多模型支持
-        ]
-        
-        # 检查是否为支持的模型
-        for supported in supported_models:
-            if model.startswith(supported):
-                return True
-        
-        # 对于自定义模型，根据配置决定
-        return settings.force_structured_output
+        return _supports_structured_output(
+            model,
+            settings.enable_structured_output,
+            settings.require_server_side_schema,
+            settings.force_structured_output
+        )
 
 class SimpleAIProcessor:
     """简化AI代码分析处理器"""
@@ -375,16 +1094,21 @@ class SimpleAIProcessor:
         self.model = model or settings.default_ai_model
         self.fallback_model = settings.fallback_ai_model
         self.token_manager = TokenManager(self.model)
+        # AI调用（安全/性能专项分析）的最大并发数
+        self.max_concurrency = settings.max_concurrent_file_reviews
         
-        # 延迟初始化OpenAI客户端，避免启动时的依赖问题
+        # 延迟初始化OpenAI客户端，避免启动时的依赖问题；初始化失败时记为False，配置变更前不再重试
         self._client = None
+        self._client_config = None
         
         logger.info(f"SimpleAIProcessor initialized with model: {self.model}")
     
     @property
     def client(self):
-        """延迟初始化OpenAI客户端，失败时返回None以启用基础模式"""
-        if self._client is None:
+        """延迟初始化OpenAI客户端，失败时返回False以启用基础模式"""
+        client_config = (settings.openai_api_key, settings.api_base_url)
+        if self._client is None or (self._client is False and client_config != self._client_config):
+            self._client_config = client_config
             try:
                 self._client = SimpleOpenAIClient(
                     api_key=settings.openai_api_key,
@@ -394,8 +1118,8 @@ class SimpleAIProcessor:
             except Exception as e:
                 logger.error(f"Failed to initialize OpenAI client: {e}")
                 logger.warning("AI client unavailable, will use basic analysis mode only")
-                # 返回False表示客户端不可用，而不是抛出异常
-                return False
+                # 记录失败结果，避免每次可用性检查都重新创建客户端；返回False而不是抛出异常
+                self._client = False
         return self._client
     
     def _is_ai_available(self) -> bool:
@@ -404,12 +1128,16 @@ class SimpleAIProcessor:
     
     async def analyze_merge_request(self, diff_files: List[FilePatchInfo],
                                   review_type: str, mr_info: Dict,
-                                  historical_issues: Optional[Dict[str, List[Dict]]] = None) -> Dict[str, Any]:
-        """分析MR的主入口函数"""
-        import time
-
+                                  historical_issues: Optional[Dict[str, List[Dict]]] = None,
+                                  allow_batch: bool = False) -> Dict[str, Any]:
+        """
+        分析MR的主入口函数
+
+        allow_batch 仅由非交互（后台任务）流程开启：Batch API 结果可能需要等待较长时间，
+        同步请求不能走该路径
+        """
         # 记录分析开始
-        start_time = time.time()
+        start_time = time.perf_counter()
         logger.info("🔍" + "=" * 80)
         logger.info("🔍 开始代码审查分析")
         logger.info("🔍" + "=" * 80)
@@ -436,7 +1164,10 @@ class SimpleAIProcessor:
             logger.info(f"⚡ 开始执行 {review_type} 类型审查...")
 
             # 根据审查类型和配置选择分析策略
-            if settings.enable_per_file_review and len(diff_files) > 1:
+            if (allow_batch and settings.enable_per_file_review and settings.enable_batch_mode
+                    and len(diff_files) >= max(2, settings.batch_mode_min_files)):
+                result = await self._per_file_analysis_batch(diff_files, review_type, mr_info, historical_issues)
+            elif settings.enable_per_file_review and len(diff_files) > 1:
                 result = await self._per_file_analysis(diff_files, review_type, mr_info, historical_issues)
             elif review_type == "security":
                 result = await self._security_focused_analysis(diff_files, mr_info)
@@ -452,7 +1183,7 @@ class SimpleAIProcessor:
             result["cost_estimate"] = cost_estimate
 
             # 记录分析完成
-            end_time = time.time()
+            end_time = time.perf_counter()
             analysis_time = end_time - start_time
 
             logger.info("✅" + "=" * 80)
@@ -481,7 +1212,7 @@ class SimpleAIProcessor:
             return result
 
         except Exception as e:
-            end_time = time.time()
+            end_time = time.perf_counter()
             analysis_time = end_time - start_time
 
             logger.error("❌" + "=" * 80)
@@ -515,6 +1246,23 @@ class SimpleAIProcessor:
         """异步上下文管理器出口"""
         await self._cleanup_client()
     
+    @staticmethod
+    def _file_review_limiter() -> Tuple[Any, Optional[AdaptiveConcurrencyController]]:
+        """
+        逐文件实时分析的并发控制，返回 (限流器, 自适应控制器)
+
+        自适应模式下根据延迟与限流情况动态调整，上限为 max_concurrent_file_reviews；
+        否则使用固定大小的信号量，此时控制器为 None
+        """
+        if settings.enable_adaptive_concurrency:
+            controller = AdaptiveConcurrencyController(
+                initial_limit=min(4, settings.max_concurrent_file_reviews),
+                max_limit=settings.max_concurrent_file_reviews,
+                latency_threshold=settings.adaptive_concurrency_latency_threshold
+            )
+            return controller, controller
+        return asyncio.Semaphore(settings.max_concurrent_file_reviews), None
+
     async def _per_file_analysis(self, diff_files: List[FilePatchInfo],
                                review_type: str, mr_info: Dict,
                                historical_issues: Optional[Dict[str, List[Dict]]] = None) -> Dict[str, Any]:
@@ -522,44 +1270,223 @@ class SimpleAIProcessor:
         logger.info(f"🚀 启动逐文件并行分析，文件数量: {len(diff_files)}")
         logger.info(f"🔧 最大并发数: {settings.max_concurrent_file_reviews}")
 
-        # 使用信号量控制并发数
-        semaphore = asyncio.Semaphore(settings.max_concurrent_file_reviews)
+        # 预先准备所有文件内容，并一次性批量计算token数
+        prepared_contents = [self._prepare_file_content_for_analysis(fp) for fp in diff_files]
+        token_sizes = self.token_manager.count_tokens_batch(prepared_contents)
+        logger.info(f"📏 待分析内容总计约 {sum(token_sizes)} tokens")
 
-        async def analyze_single_file(file_patch: FilePatchInfo) -> Dict[str, Any]:
-            async with semaphore:
+        limiter, controller = self._file_review_limiter()
+
+        async def analyze_single_file(index: int) -> Dict[str, Any]:
+            async with limiter:
+                file_patch = diff_files[index]
                 # 获取该文件的历史问题
                 file_historical_issues = (historical_issues or {}).get(file_patch.filename, [])
-                return await self._analyze_single_file(file_patch, review_type, file_historical_issues)
+                return await self._analyze_single_file(
+                    file_patch, review_type, file_historical_issues,
+                    prepared_content=prepared_contents[index],
+                    concurrency_controller=controller
+                )
+
+        # 大文件优先调度，避免最慢的文件排在最后拖长整体耗时；结果仍按原顺序聚合
+        schedule_order = sorted(range(len(diff_files)), key=lambda i: token_sizes[i], reverse=True)
+        tasks = {i: asyncio.ensure_future(analyze_single_file(i)) for i in schedule_order}
 
-        # 并行处理所有文件
-        start_time = time.time()
-        tasks = [analyze_single_file(file_patch) for file_patch in diff_files]
-        file_results = await asyncio.gather(*tasks, return_exceptions=True)
+        async def wait_indexed(index: int):
+            try:
+                return index, await tasks[index]
+            except Exception as e:
+                return index, e
+
+        # 并行处理所有文件，按完成顺序收集结果（仍按原索引存放）
+        start_time = time.perf_counter()
+        file_results: List[Any] = [None] * len(diff_files)
+        speculative_summary = None
+        speculative_threshold = math.ceil(len(diff_files) * SPECULATIVE_SUMMARY_RATIO)
+        completed = 0
+        try:
+            for next_done in asyncio.as_completed([wait_indexed(i) for i in schedule_order]):
+                index, result = await next_done
+                file_results[index] = result
+                completed += 1
+
+                # 大部分文件完成后，用已有结果预先生成全局总结，与剩余文件的分析重叠
+                if (speculative_summary is None and speculative_threshold <= completed < len(diff_files)
+                        and self._is_ai_available()):
+                    speculative_summary = self._start_speculative_summary(diff_files, file_results, mr_info)
+        except BaseException:
+            if speculative_summary is not None:
+                speculative_summary[1].cancel()
+            raise
+        finally:
+            # 外层被取消或出错时，不让尚未完成的文件分析在后台继续占用AI配额
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
 
-        parallel_time = time.time() - start_time
+        parallel_time = time.perf_counter() - start_time
         logger.info(f"⚡ 并行文件分析完成，耗时: {parallel_time:.2f}秒")
 
-        # 聚合结果
+        return await self._aggregate_per_file_results(
+            diff_files, file_results, review_type, mr_info, parallel_time,
+            speculative_summary=speculative_summary
+        )
+
+    def _start_speculative_summary(self, diff_files: List[FilePatchInfo], file_results: List[Any],
+                                   mr_info: Dict) -> Tuple[tuple, "asyncio.Future"]:
+        """基于部分文件结果预先发起全局总结，返回 (统计快照, 总结任务)"""
+        all_findings, all_suggestions, failed_files = self._collect_file_results(
+            diff_files, file_results, log_errors=False
+        )
+        severity_counts = Counter(f.get("severity", "low") for f in all_findings)
+        type_counts = Counter(f.get("type", "unknown") for f in all_findings)
+        logger.info(f"🔮 已完成 {sum(r is not None for r in file_results)}/{len(diff_files)} 个文件，预先生成全局总结")
+
+        summary_task = asyncio.ensure_future(self._generate_global_summary(
+            all_findings, all_suggestions, mr_info, failed_files,
+            severity_counts=severity_counts, type_counts=type_counts
+        ))
+        stats_key = self._summary_stats_key(severity_counts, type_counts, all_suggestions, failed_files)
+        return stats_key, summary_task
+
+    @staticmethod
+    def _summary_stats_key(severity_counts: Counter, type_counts: Counter,
+                           all_suggestions: List[str], failed_files: List[str]) -> tuple:
+        """全局总结提示词所依赖的统计快照，快照相同则总结提示词完全相同"""
+        return (
+            severity_counts["high"], severity_counts["medium"], severity_counts["low"],
+            len(failed_files), tuple(type_counts.most_common(5)), len(all_suggestions)
+        )
+
+    def _collect_file_results(self, diff_files: List[FilePatchInfo], file_results: List[Any],
+                              log_errors: bool = True) -> Tuple[List[Dict], List[str], List[str]]:
+        """汇总逐文件结果，返回 (findings, suggestions, 失败文件)；未完成(None)的文件跳过"""
         all_findings = []
         all_suggestions = []
         failed_files = []
 
         for i, result in enumerate(file_results):
+            if result is None:
+                continue
             if isinstance(result, Exception):
-                logger.error(f"文件 {diff_files[i].filename} 分析失败: {result}")
+                if log_errors:
+                    logger.error(f"文件 {diff_files[i].filename} 分析失败: {result}")
                 failed_files.append(diff_files[i].filename)
                 continue
 
             all_findings.extend(result.get("findings", []))
             all_suggestions.extend(result.get("suggestions", []))
 
-        # 生成全局总结
-        global_summary = await self._generate_global_summary(
-            all_findings, all_suggestions, mr_info, failed_files
+        return all_findings, all_suggestions, failed_files
+
+    async def _per_file_analysis_batch(self, diff_files: List[FilePatchInfo],
+                                     review_type: str, mr_info: Dict,
+                                     historical_issues: Optional[Dict[str, List[Dict]]] = None) -> Dict[str, Any]:
+        """逐文件分析 - Batch API模式
+
+        所有文件的请求合并为一个JSONL批任务提交，成本约为实时调用的一半，适合无需即时返回的审查。
+        批任务失败或超时时回退到实时并行分析；批结果中缺失的文件单独走实时调用补齐。
+        """
+        logger.info(f"📦 启动Batch模式逐文件分析，文件数量: {len(diff_files)}")
+
+        if not self._is_ai_available():
+            return await self._per_file_analysis(diff_files, review_type, mr_info, historical_issues)
+
+        start_time = time.perf_counter()
+        prepared_contents = [self._prepare_file_content_for_analysis(fp) for fp in diff_files]
+
+        # custom_id 使用文件序号，避免文件名过长或重复
+        requests = {}
+        for i, file_patch in enumerate(diff_files):
+            if not prepared_contents[i]:
+                continue
+            file_historical_issues = (historical_issues or {}).get(file_patch.filename, [])
+            messages = self._build_single_file_messages(
+                file_patch, prepared_contents[i], review_type, file_historical_issues
+            )
+            requests[f"file-{i}"] = self.client._build_api_params(
+                messages, self.model, SINGLE_FILE_ANALYSIS_SCHEMA,
+                **SINGLE_FILE_COMPLETION_PARAMS
+            )
+
+        try:
+            responses = await self.client.batch_chat_completions(
+                requests,
+                poll_interval=settings.batch_mode_poll_interval,
+                max_wait_seconds=settings.batch_mode_max_wait_seconds
+            )
+        except Exception as e:
+            logger.warning(f"Batch模式分析失败，回退到实时并行分析: {e}")
+            return await self._per_file_analysis(diff_files, review_type, mr_info, historical_issues)
+
+        # 批结果缺失的文件回退实时分析时与实时路径使用相同的并发控制，避免批任务大面积失败时瞬间涌出大量请求
+        limiter, controller = self._file_review_limiter()
+
+        async def resolve_file(index: int) -> Dict[str, Any]:
+            file_patch = diff_files[index]
+            custom_id = f"file-{index}"
+            if custom_id not in requests:
+                return {"filename": file_patch.filename, "findings": [], "suggestions": []}
+            if custom_id in responses:
+                return self._parse_single_file_response(responses[custom_id], file_patch)
+            # 批结果缺失的文件单独实时分析
+            logger.warning(f"文件 {file_patch.filename} 未获得Batch结果，改为实时分析")
+            async with limiter:
+                return await self._analyze_single_file(
+                    file_patch, review_type,
+                    (historical_issues or {}).get(file_patch.filename, []),
+                    prepared_content=prepared_contents[index],
+                    concurrency_controller=controller
+                )
+
+        file_results = await asyncio.gather(
+            *(resolve_file(i) for i in range(len(diff_files))), return_exceptions=True
+        )
+
+        batch_time = time.perf_counter() - start_time
+        logger.info(f"📦 Batch模式文件分析完成，耗时: {batch_time:.2f}秒")
+
+        return await self._aggregate_per_file_results(
+            diff_files, file_results, review_type, mr_info, batch_time
         )
 
+    async def _aggregate_per_file_results(self, diff_files: List[FilePatchInfo],
+                                        file_results: List[Any], review_type: str,
+                                        mr_info: Dict, parallel_time: float,
+                                        speculative_summary: Optional[Tuple[tuple, "asyncio.Future"]] = None) -> Dict[str, Any]:
+        """聚合逐文件分析结果，生成全局总结与评分
+
+        speculative_summary 为预先基于部分结果发起的 (统计快照, 总结任务)；
+        最终统计与快照一致时直接复用，否则取消并重新生成。
+        """
+        # 聚合结果
+        all_findings, all_suggestions, failed_files = self._collect_file_results(diff_files, file_results)
+
+        # 一次遍历统计严重程度与问题类型，供总结和评分共用
+        severity_counts = Counter(f.get("severity", "low") for f in all_findings)
+        type_counts = Counter(f.get("type", "unknown") for f in all_findings)
+
+        # 生成全局总结
+        global_summary = None
+        if speculative_summary is not None:
+            stats_key, summary_task = speculative_summary
+            if stats_key == self._summary_stats_key(severity_counts, type_counts, all_suggestions, failed_files):
+                global_summary = await summary_task
+                logger.info("🔮 剩余文件未改变统计结果，复用预先生成的全局总结")
+            else:
+                summary_task.cancel()
+                logger.info("🔮 剩余文件改变了统计结果，重新生成全局总结")
+
+        if global_summary is None:
+            global_summary = await self._generate_global_summary(
+                all_findings, all_suggestions, mr_info, failed_files,
+                severity_counts=severity_counts, type_counts=type_counts
+            )
+
         # 计算整体评分
-        score = self._calculate_overall_score(all_findings, diff_files, failed_files)
+        score = self._calculate_overall_score(
+            all_findings, diff_files, failed_files, severity_counts=severity_counts
+        )
 
         logger.info(f"📊 逐文件分析完成:")
         logger.info(f"  - 成功分析文件: {len(diff_files) - len(failed_files)}")
@@ -580,11 +1507,11 @@ class SimpleAIProcessor:
     
     async def _analyze_single_file(self, file_patch: FilePatchInfo,
                                  review_type: str,
-                                 historical_issues: Optional[List[Dict]] = None) -> Dict[str, Any]:
-        """分析单个文件"""
-        import time
-
-        start_time = time.time()
+                                 historical_issues: Optional[List[Dict]] = None,
+                                 prepared_content: Optional[str] = None,
+                                 concurrency_controller: Optional[AdaptiveConcurrencyController] = None) -> Dict[str, Any]:
+        """分析单个文件（prepared_content 为已准备好的分析内容，避免重复构建）"""
+        start_time = time.perf_counter()
         logger.info(f"📄 开始分析文件: {file_patch.filename}")
 
         if historical_issues:
@@ -595,7 +1522,9 @@ class SimpleAIProcessor:
             # basic_issues = self._detect_basic_issues(file_patch)
 
             # 构建完整文件内容用于AI分析
-            full_file_content = self._prepare_file_content_for_analysis(file_patch)
+            if prepared_content is None:
+                prepared_content = self._prepare_file_content_for_analysis(file_patch)
+            full_file_content = prepared_content
 
             # AI深度分析
             ai_findings = []
@@ -604,7 +1533,8 @@ class SimpleAIProcessor:
             if self._is_ai_available() and full_file_content:
                 try:
                     ai_result = await self._ai_single_file_analysis(
-                        file_patch, full_file_content, review_type, historical_issues
+                        file_patch, full_file_content, review_type, historical_issues,
+                        concurrency_controller=concurrency_controller
                     )
                     ai_findings = ai_result.get("findings", [])
                     ai_suggestions = ai_result.get("suggestions", [])
@@ -615,7 +1545,7 @@ class SimpleAIProcessor:
             #all_findings = basic_issues + ai_findings
             all_findings = ai_findings
 
-            end_time = time.time()
+            end_time = time.perf_counter()
             analysis_time = end_time - start_time
 
             logger.info(f"✅ 文件 {file_patch.filename} 分析完成 ({analysis_time:.2f}秒)")
@@ -630,7 +1560,7 @@ class SimpleAIProcessor:
             }
 
         except Exception as e:
-            end_time = time.time()
+            end_time = time.perf_counter()
             logger.error(f"❌ 文件 {file_patch.filename} 分析失败: {e} ({end_time - start_time:.2f}秒)")
             raise
     
@@ -645,12 +1575,13 @@ class SimpleAIProcessor:
             logger.debug(f"文件 {file_patch.filename} 无完整内容，仅使用diff")
             return file_patch.patch
         
-        # 按行截断文件内容
-        lines = full_content.splitlines()
-        if len(lines) > settings.max_file_lines:
-            logger.info(f"文件 {file_patch.filename} 行数过多({len(lines)})，截断至{settings.max_file_lines}行")
-            truncated_content = '\n'.join(lines[:settings.max_file_lines])
-            truncated_content += f"\n... [文件被截断，原始行数: {len(lines)}]"
+        # 按行截断文件内容：先用 count 统计行数，只有超限时才切分，且 maxsplit 只切出需要的前几行
+        max_lines = settings.max_file_lines
+        line_count = full_content.count('\n') + (not full_content.endswith('\n'))
+        if line_count > max_lines:
+            logger.info(f"文件 {file_patch.filename} 行数过多({line_count})，截断至{max_lines}行")
+            truncated_content = '\n'.join(full_content.split('\n', max_lines)[:max_lines])
+            truncated_content += f"\n... [文件被截断，原始行数: {line_count}]"
         else:
             truncated_content = full_content
         
@@ -673,153 +1604,207 @@ class SimpleAIProcessor:
     
     async def _ai_single_file_analysis(self, file_patch: FilePatchInfo,
                                      full_content: str, review_type: str,
-                                     historical_issues: Optional[List[Dict]] = None) -> Dict[str, Any]:
+                                     historical_issues: Optional[List[Dict]] = None,
+                                     concurrency_controller: Optional[AdaptiveConcurrencyController] = None) -> Dict[str, Any]:
         """对单个文件进行AI分析"""
         if not self._is_ai_available():
             return {"findings": [], "suggestions": []}
 
-        # 根据审查类型构建不同的提示词
-        focus_areas = REVIEW_TYPES.get(review_type, {}).get("focus_areas", ["quality"])
-        focus_description = ", ".join(focus_areas)
-
-        # 构建历史问题的提示 - 强制关注历史问题
-        historical_context = ""
-
-        if historical_issues:
-            historical_context = "\n\n🔴 **重要：本次审查为历史问题追踪模式**\n\n"
-            historical_context += "⚠️ **上一次审查发现的问题清单**：\n\n"
+        messages = self._build_single_file_messages(file_patch, full_content, review_type, historical_issues)
 
-            for i, issue in enumerate(historical_issues, 1):
-                historical_context += f"{i}. [{issue.get('severity', 'low').upper()}] {issue.get('type', 'unknown')}\n"
-                historical_context += f"   描述: {issue.get('description', 'N/A')}\n"
-                if issue.get('line_number'):
-                    historical_context += f"   位置: 第{issue.get('line_number')}行附近\n"
-                historical_context += f"   修复建议: {issue.get('suggestion', 'N/A')}\n\n"
-
-            historical_context += "\n🎯 **强制审查要求（极其重要）**：\n"
-            historical_context += "1. **仅关注历史问题**：只检查上述历史问题相关的代码区域是否有修改\n"
-            historical_context += "2. **检查修复状态**：对每个历史问题，判断本次 diff 中是否已修复\n"
-            historical_context += "3. **修复即清除**：如果历史问题已被正确修复且没有引入新的严重问题，返回空 findings []\n"
-            historical_context += "4. **问题持续**：如果历史问题仍然存在（代码未改或改得不对），在 findings 中报告\n"
-            historical_context += "5. **新问题严格限制**：除非是严重影响生产的新问题（如安全漏洞、崩溃风险），否则不要报告新问题\n"
-            historical_context += "6. **不要报告其他代码**：不要审查与历史问题无关的代码区域\n\n"
-            historical_context += "💡 **理想结果**：如果开发者正确修复了所有历史问题，你应该返回 findings: []\n\n"
-
-        base_prompt = f"""
-请专门分析以下文件的代码变更。
-
-{full_content}
-{historical_context}
+        # 相同请求参数与提示词的响应直接复用（重复审查同一提交、任务重试等场景）；
+        # 键中包含模型、结构化输出模式与采样参数，配置变更后不会把一种模式的原始回复交给另一种模式解析
+        output_params = self.client._build_api_params(
+            [], self.model, SINGLE_FILE_ANALYSIS_SCHEMA, **SINGLE_FILE_COMPLETION_PARAMS
+        )
+        cache_key = _content_digest(json_utils.dumps(output_params), *(msg["content"] for msg in messages))
+        cached_response = _single_file_response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info(f"♻️ 文件 {file_patch.filename} 命中AI响应缓存")
+            return self._parse_single_file_response(cached_response, file_patch)
 
-{'🔴 **审查模式：历史问题追踪模式**' if historical_issues else '📋 **审查模式：常规代码审查**'}
+        try:
+            cache_kwargs = await self._prompt_cache_kwargs(bool(historical_issues))
+
+            if settings.enable_streaming_completion:
+                findings_parser = StreamingFindingsParser()
+                response, complete = await self.client.chat_completion_stream(
+                    messages=messages,
+                    model=self.model,
+                    response_format=SINGLE_FILE_ANALYSIS_SCHEMA,
+                    findings_parser=findings_parser,
+                    concurrency_controller=concurrency_controller,
+                    **SINGLE_FILE_COMPLETION_PARAMS,
+                    **cache_kwargs
+                )
+                result = self._parse_single_file_response(response, file_patch)
+                # 只缓存完整的响应：被截断的内容重放时无法再用增量解析结果补救
+                if complete and '"findings"' in response:
+                    _single_file_response_cache.put(cache_key, response)
+                # 完整JSON解析失败（如输出被截断）时，使用增量解析出的 findings
+                if not result.get("findings") and findings_parser.findings:
+                    logger.info(f"使用流式增量解析结果: {len(findings_parser.findings)} 个finding")
+                    result = self._validate_and_fix_result({
+                        "findings": findings_parser.findings,
+                        "suggestions": []
+                    })
+                    for finding in result.get("findings", []):
+                        finding["filename"] = file_patch.filename
+                return result
+
+            # 未使用服务端schema约束时，解析失败后把错误反馈给模型重试
+            max_retries = 0 if self.client._supports_structured_output(self.model) else SINGLE_FILE_FORMAT_MAX_RETRIES
+            for attempt in range(max_retries + 1):
+                response = await self.client.chat_completion(
+                    messages=messages,
+                    model=self.model,
+                    response_format=SINGLE_FILE_ANALYSIS_SCHEMA,
+                    concurrency_controller=concurrency_controller,
+                    **SINGLE_FILE_COMPLETION_PARAMS,
+                    **cache_kwargs
+                )
+                try:
+                    result = self._parse_single_file_response(
+                        response, file_patch, raise_on_error=attempt < max_retries
+                    )
+                    if '"findings"' in response:
+                        _single_file_response_cache.put(cache_key, response)
+                    return result
+                except ValueError as e:
+                    logger.warning(f"文件 {file_patch.filename} 响应格式无效，第 {attempt + 1} 次重试: {e}")
+                    messages = messages + [
+                        {"role": "assistant", "content": response},
+                        {"role": "user", "content": f"上一次回复不是有效的JSON（{str(e)[:200]}），"
+                                                    "请严格按照要求的JSON格式重新输出，不要添加任何其他内容。"}
+                    ]
+                    await asyncio.sleep(1.0 * (attempt + 1))
 
-{'**审查要求（历史问题模式）**：' if historical_issues else '**分析要求**：'}
-{'''
-1. **只看历史问题区域**：仅检查上述历史问题所在的代码行及其周边代码在本次 diff 中的修改情况
-2. **判断修复状态**：
-   - 如果问题已修复且没引入新的严重bug → findings 返回空数组 []
-   - 如果问题未修复或修复不当 → findings 中报告该历史问题
-   - 如果引入了严重的新问题（如安全漏洞）→ findings 中报告新问题
-3. **严格限制新问题**：不要审查与历史问题无关的代码，不要报告小问题或建议性问题
-4. **目标**：帮助开发者确认历史问题是否已修复，而不是发现新问题
-''' if historical_issues else '''
-1. **避免重复发现**：对于同一个根本问题，合并到一个 finding
-2. **合并相关问题**：同一代码行的多个问题整合为一个描述
-3. **聚焦关键问题**：只报告对代码功能和质量有重大影响的问题（0-3个）
-4. **只审查 diff**：只关注 diff 部分的变更，不要审查整个文件内容
-5. **无伤大雅的问题不报告**：代码风格、注释建议等小问题不要报告
-'''}
+        except Exception as e:
+            logger.error(f"AI单文件分析失败: {e}")
+            return {"findings": [], "suggestions": []}
 
-注意：这是单文件分析。{' ⚠️ 本次是历史问题追踪，如果历史问题都已修复，请返回空的 findings: []' if historical_issues else ''}
-"""
+    def _single_file_static_prefix(self, historical_mode: bool) -> str:
+        """单文件分析用户消息中与文件无关的静态前缀（审查要求 + JSON格式说明）"""
+        prefix = _SINGLE_FILE_HISTORY_INSTRUCTIONS if historical_mode else _SINGLE_FILE_REGULAR_INSTRUCTIONS
 
         # 如果不支持结构化输出，添加JSON格式说明
         if not self.client._supports_structured_output(self.model):
-            prompt = base_prompt + """
+            prefix = prefix + "\n" + _SINGLE_FILE_JSON_FORMAT_INSTRUCTIONS
+        return prefix
 
-⚠️ 重要：请严格按照以下JSON格式回复，不要添加任何其他文本、解释或markdown标记：
+    async def _prompt_cache_kwargs(self, historical_mode: bool) -> Dict[str, Any]:
+        """提示词前缀缓存参数
 
-{
-    "findings": [
-        {
-            "type": "问题类型",
-            "line_number": 行号,
-            "severity": "high/medium/low",
-            "description": "完整的问题描述（如果同一行有多个相关问题，请合并描述）",
-            "suggestion": "综合的修复建议"
-        }
-    ],
-    "suggestions": ["改进建议1", "改进建议2"]
-}
+        按静态前缀计算摘要作为 prompt_cache_key，使同一前缀的请求路由到同一缓存；
+        每个前缀首次使用时发送一次预热请求，并发的调用方等待同一个预热任务，避免重复预热。
+        """
+        if not settings.enable_prompt_cache_hints:
+            return {}
 
-格式要求：
-1. 输出必须是有效的JSON格式
-2. 不要用```json或其他代码块包装
-3. 不要添加任何解释文字
-4. 确保所有字符串都用双引号包围
-5. 确保同一行或相关的问题只生成一个finding对象
-"""
-        else:
-            prompt = base_prompt
+        static_prefix = self._single_file_static_prefix(historical_mode)
+        prefix_hash = _content_digest(self.model, SINGLE_FILE_SYSTEM_MESSAGE, static_prefix)[:16]
 
-        try:
-            response = await self.client.chat_completion(
+        warmup = _prompt_prefix_warmups.get(prefix_hash)
+        if warmup is None:
+            warmup = asyncio.ensure_future(self.client.chat_completion(
                 messages=[
-                    {"role": "system", "content": "你是一个专业的代码审查专家，专注于单文件代码分析。"},
-                    {"role": "user", "content": prompt}
+                    {"role": "system", "content": SINGLE_FILE_SYSTEM_MESSAGE},
+                    {"role": "user", "content": static_prefix}
                 ],
                 model=self.model,
-                temperature=0.2,
-                max_tokens=2000,
-                response_format={
-                    "type": "object",
-                    "properties": {
-                        "findings": {
-                            "type": "array",
-                            "items": {
-                                "type": "object",
-                                "properties": {
-                                    "type": {"type": "string"},
-                                    "line_number": {"type": "integer"},
-                                    "severity": {"type": "string", "enum": ["high", "medium", "low"]},
-                                    "description": {"type": "string"},
-                                    "suggestion": {"type": "string"}
-                                },
-                                "required": ["type", "severity", "description"]
-                            }
-                        },
-                        "suggestions": {
-                            "type": "array",
-                            "items": {"type": "string"}
-                        }
-                    },
-                    "required": ["findings", "suggestions"]
-                }
-            )
+                max_tokens=1,
+                extra_body={"prompt_cache_key": prefix_hash}
+            ))
+            _prompt_prefix_warmups[prefix_hash] = warmup
+            logger.info(f"🔥 预热提示词前缀缓存: {prefix_hash}")
+
+        try:
+            await asyncio.shield(warmup)
+        except Exception as e:
+            # 预热失败不影响正常分析，下次重新预热
+            logger.warning(f"提示词前缀缓存预热失败 (ignored): {e}")
+            _prompt_prefix_warmups.pop(prefix_hash, None)
+
+        return {"extra_body": {"prompt_cache_key": prefix_hash}}
+
+    def _build_single_file_messages(self, file_patch: FilePatchInfo, full_content: str,
+                                    review_type: str,
+                                    historical_issues: Optional[List[Dict]] = None) -> List[Dict]:
+        """构建单文件分析的消息列表，实时调用与Batch API共用"""
+        # 根据审查类型构建不同的提示词
+        focus_areas = REVIEW_TYPES.get(review_type, {}).get("focus_areas", ["quality"])
+        focus_description = ", ".join(focus_areas)
+
+        # 构建历史问题的提示 - 强制关注历史问题（片段收集到列表后一次 join，避免反复拼接字符串）
+        historical_context = ""
+
+        if historical_issues:
+            context_parts = [_HISTORICAL_CONTEXT_HEADER]
+            for i, issue in enumerate(historical_issues, 1):
+                context_parts.append(
+                    f"{i}. [{issue.get('severity', 'low').upper()}] {issue.get('type', 'unknown')}\n"
+                    f"   描述: {issue.get('description', 'N/A')}\n"
+                )
+                line_number = issue.get('line_number')
+                if line_number:
+                    context_parts.append(f"   位置: 第{line_number}行附近\n")
+                context_parts.append(f"   修复建议: {issue.get('suggestion', 'N/A')}\n\n")
+            context_parts.append(_HISTORICAL_CONTEXT_REQUIREMENTS)
+            historical_context = "".join(context_parts)
+
+        # 静态指令放在最前面，保证各文件请求的前缀字节一致，便于服务端复用前缀缓存；
+        # 文件相关的历史问题与代码内容放在末尾
+        prompt_parts = [self._single_file_static_prefix(bool(historical_issues))]
+
+        if historical_context:
+            prompt_parts.append(historical_context)
+        prompt_parts.append(f"请专门分析以下文件的代码变更。\n\n{full_content}\n")
+        prompt = "\n".join(prompt_parts)
+
+        return [
+            {"role": "system", "content": SINGLE_FILE_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _parse_single_file_response(self, response: str, file_patch: FilePatchInfo,
+                                    raise_on_error: bool = False) -> Dict[str, Any]:
+        """解析单文件分析的AI响应
 
+        raise_on_error 为 True 时，JSON无法解析会抛出 ValueError 供调用方重试，而不是返回默认结构
+        """
+        try:
             # 解析响应
             cleaned_response = self._extract_json_from_response(response)
 
             try:
-                result = json.loads(cleaned_response)
+                result = json_utils.loads(cleaned_response)
                 logger.debug("Successfully parsed JSON response")
-            except json.JSONDecodeError as e:
+            except json_utils.JSONDecodeError as e:
                 logger.error(f"JSON解析失败: {e}")
                 logger.error(f"尝试解析的JSON: {cleaned_response[:500]}...")
 
+                # 响应中完全没有 findings 时激进修复只会得到空结构，可重试时直接交给调用方重试
+                if raise_on_error and '"findings"' not in cleaned_response:
+                    raise ValueError(f"JSON解析错误: {e}") from e
+
                 # 尝试使用更激进的修复方法
                 try:
                     fixed_json = self._aggressive_json_fix(cleaned_response)
-                    result = json.loads(fixed_json)
+                    result = json_utils.loads(fixed_json)
                     logger.info("使用激进修复方法成功解析JSON")
                 except Exception as e2:
                     logger.error(f"激进修复也失败: {e2}")
+                    if raise_on_error:
+                        raise ValueError(f"JSON解析错误: {e}") from e2
                     # 返回默认结构
                     return {
                         "findings": [],
                         "suggestions": [f"AI分析失败，JSON解析错误: {str(e)[:100]}"]
                     }
 
+            if raise_on_error and (not isinstance(result, dict) or not isinstance(result.get("findings"), list)):
+                raise ValueError("响应结构不符合要求：缺少 findings 数组")
+
             # 验证并修复结果结构
             result = self._validate_and_fix_result(result)
 
@@ -829,31 +1814,37 @@ class SimpleAIProcessor:
 
             return result
 
+        except ValueError as e:
+            if raise_on_error:
+                raise
+            logger.error(f"AI单文件响应解析失败: {e}")
+            return {"findings": [], "suggestions": []}
         except Exception as e:
-            logger.error(f"AI单文件分析失败: {e}")
+            logger.error(f"AI单文件响应解析失败: {e}")
             return {"findings": [], "suggestions": []}
     
     async def _generate_global_summary(self, all_findings: List[Dict], 
                                      all_suggestions: List[str], mr_info: Dict,
-                                     failed_files: List[str]) -> str:
-        """生成全局分析总结"""
+                                     failed_files: List[str],
+                                     severity_counts: Optional[Counter] = None,
+                                     type_counts: Optional[Counter] = None) -> str:
+        """生成全局分析总结（severity_counts/type_counts 为调用方已统计好的计数，未提供时自行统计）"""
+        if severity_counts is None:
+            severity_counts = Counter(f.get("severity") for f in all_findings)
+
+        # 统计信息
+        high_issues = severity_counts["high"]
+        medium_issues = severity_counts["medium"]
+        low_issues = severity_counts["low"]
+
         if not self._is_ai_available():
-            high_issues = len([f for f in all_findings if f.get("severity") == "high"])
-            medium_issues = len([f for f in all_findings if f.get("severity") == "medium"])
             return f"逐文件分析完成，发现{high_issues}个高风险问题，{medium_issues}个中等风险问题。"
         
-        # 统计信息
-        high_issues = len([f for f in all_findings if f.get("severity") == "high"])
-        medium_issues = len([f for f in all_findings if f.get("severity") == "medium"])
-        low_issues = len([f for f in all_findings if f.get("severity") == "low"])
-        
         # 问题分类统计
-        issue_types = {}
-        for finding in all_findings:
-            issue_type = finding.get("type", "unknown")
-            issue_types[issue_type] = issue_types.get(issue_type, 0) + 1
+        if type_counts is None:
+            type_counts = Counter(f.get("type", "unknown") for f in all_findings)
         
-        top_issues = sorted(issue_types.items(), key=lambda x: x[1], reverse=True)[:5]
+        top_issues = type_counts.most_common(5)
         
         prompt = f"""
 请基于以下逐文件代码审查结果，生成一个全局总结：
@@ -891,19 +1882,13 @@ MR信息：
     
     def _calculate_overall_score(self, all_findings: List[Dict], 
                                diff_files: List[FilePatchInfo], 
-                               failed_files: List[str]) -> float:
+                               failed_files: List[str],
+                               severity_counts: Optional[Counter] = None) -> float:
         """计算整体评分"""
         base_score = 8.0
         
         # 根据问题严重程度扣分
-        for finding in all_findings:
-            severity = finding.get("severity", "low")
-            if severity == "high":
-                base_score -= 1.0
-            elif severity == "medium":
-                base_score -= 0.5
-            else:
-                base_score -= 0.2
+        base_score -= _severity_penalty(all_findings, SEVERITY_SCORE_WEIGHTS, severity_counts)
         
         # 根据失败文件扣分
         if failed_files:
@@ -923,18 +1908,23 @@ MR信息：
         all_findings = []
         all_suggestions = []
         
-        # 基础问题检测
-        for file_patch in diff_files:
-            basic_issues = self._detect_basic_issues(file_patch)
-            all_findings.extend(basic_issues)
-        
         # AI深度分析
-        try:
-            ai_analysis = await self._ai_comprehensive_analysis(diff_files, mr_info)
-            all_findings.extend(ai_analysis.get("findings", []))
-            all_suggestions.extend(ai_analysis.get("suggestions", []))
-        except Exception as e:
-            logger.warning(f"AI analysis failed, using basic analysis only: {e}")
+        async def ai_comprehensive_analysis() -> Dict[str, Any]:
+            try:
+                return await self._ai_comprehensive_analysis(diff_files, mr_info)
+            except Exception as e:
+                logger.warning(f"AI analysis failed, using basic analysis only: {e}")
+                return {}
+        
+        # 基础问题检测在线程池中执行，与AI请求同时进行
+        basic_issues_by_file, ai_analysis = await asyncio.gather(
+            asyncio.gather(*(asyncio.to_thread(self._detect_basic_issues, file_patch) for file_patch in diff_files)),
+            ai_comprehensive_analysis()
+        )
+        for basic_issues in basic_issues_by_file:
+            all_findings.extend(basic_issues)
+        all_findings.extend(ai_analysis.get("findings", []))
+        all_suggestions.extend(ai_analysis.get("suggestions", []))
         
         # 计算综合评分
         score = self._calculate_comprehensive_score(all_findings, diff_files)
@@ -950,30 +1940,87 @@ MR信息：
     
     async def _security_focused_analysis(self, diff_files: List[FilePatchInfo], 
                                        mr_info: Dict) -> Dict[str, Any]:
-        """安全专项分析"""
-        security_issues = []
-        
-        for file_patch in diff_files:
-            # 检测常见安全问题
-            issues = self._detect_security_issues(file_patch)
-            security_issues.extend(issues)
-            
-            # 对每个潜在问题进行AI深度分析
-            for issue in issues:
+        """安全专项分析
+
+        检测与AI分析流水线化：生产者逐文件检测并把疑似问题按 SECURITY_BATCH_SIZE 分批入队，
+        多个消费者同时取批次调用AI，AI请求不必等待全部文件检测完成。
+        """
+        if not self._is_ai_available():
+            # AI不可用时只做规则检测，不构建任何AI请求
+            logger.info("AI client not available, skipping AI security analysis")
+            issues_by_file = await asyncio.gather(
+                *(asyncio.to_thread(self._detect_security_issues, file_patch) for file_patch in diff_files)
+            )
+            return self._build_security_result([issue for issues in issues_by_file for issue in issues])
+
+        workers = max(1, self.max_concurrency)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2 * workers)
+        issues_by_file: List[List[Dict]] = []
+        # 与全部疑似问题一一对应的AI分析结果，命中缓存的在入队前直接填入
+        ai_results: List[Any] = []
+
+        def analysis_item(filename: str, issue: Dict) -> Tuple[str, int, str, str]:
+            # 从描述中提取代码行（如果需要）
+            code_line = issue.get("description", "").split("代码：")[-1] if "代码：" in issue.get("description", "") else ""
+            return filename, issue["line_number"], code_line, issue["category"]
+
+        async def produce():
+            batch: List[Tuple[int, Tuple[str, int, str, str]]] = []
+            try:
+                for file_patch in diff_files:
+                    # 检测常见安全问题（正则扫描放到线程中执行，不阻塞事件循环中在途的AI请求）
+                    issues = await asyncio.to_thread(self._detect_security_issues, file_patch)
+                    issues_by_file.append(issues)
+                    for issue in issues:
+                        item = analysis_item(file_patch.filename, issue)
+                        cached = self._cached_security_analysis(*item)
+                        ai_results.append(cached)
+                        if cached is not None:
+                            continue
+                        batch.append((len(ai_results) - 1, item))
+                        if len(batch) == SECURITY_BATCH_SIZE:
+                            await queue.put(batch)
+                            batch = []
+                if batch:
+                    await queue.put(batch)
+            finally:
+                for _ in range(workers):
+                    await queue.put(None)
+
+        async def consume():
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    return
+                positions, items = zip(*batch)
                 try:
-                    # 从描述中提取代码行（如果需要）
-                    code_line = issue.get("description", "").split("代码：")[-1] if "代码：" in issue.get("description", "") else ""
-                    ai_result = await self._ai_security_analysis(
-                        file_patch.filename, 
-                        issue["line_number"], 
-                        code_line,
-                        issue["category"]
-                    )
-                    if ai_result["is_vulnerability"]:
-                        security_issues.append(ai_result)
+                    if len(items) == 1:
+                        results = [await self._ai_security_analysis(*items[0])]
+                    else:
+                        results = await self._ai_security_analysis_batch(list(items))
                 except Exception as e:
-                    logger.warning(f"Security AI analysis failed: {e}")
+                    # 请求异常时该批次的每个问题都记为失败
+                    results = [e] * len(items)
+                for position, result in zip(positions, results):
+                    ai_results[position] = result
+
+        await asyncio.gather(produce(), *(consume() for _ in range(workers)))
+
+        # 按原顺序组装：每个文件的检测结果后紧跟其确认的漏洞
+        security_issues = []
+        ai_results_iter = iter(ai_results)
+        for issues in issues_by_file:
+            security_issues.extend(issues)
+            for ai_result in itertools.islice(ai_results_iter, len(issues)):
+                if isinstance(ai_result, Exception):
+                    logger.warning(f"Security AI analysis failed: {ai_result}")
+                elif ai_result.get("is_vulnerability"):
+                    security_issues.append(ai_result)
         
+        return self._build_security_result(security_issues)
+
+    def _build_security_result(self, security_issues: List[Dict]) -> Dict[str, Any]:
+        """汇总安全专项分析结果"""
         security_score = self._calculate_security_score(security_issues)
         
         return {
@@ -989,15 +2036,17 @@ MR信息：
         """性能专项分析"""
         performance_issues = []
         
-        for file_patch in diff_files:
-            # 检查常见性能问题
-            issues = self._detect_performance_issues(file_patch)
+        # 检查常见性能问题（各文件的正则扫描在线程池中并行执行）
+        issues_by_file = await asyncio.gather(
+            *(asyncio.to_thread(self._detect_performance_issues, file_patch) for file_patch in diff_files)
+        )
+        for issues in issues_by_file:
             performance_issues.extend(issues)
         
-        # 使用AI进行深度性能分析
-        if performance_issues:
+        # 使用AI进行深度性能分析（AI不可用时不构建提示词）
+        if performance_issues and self._is_ai_available():
             try:
-                ai_analysis = await self._ai_performance_analysis(performance_issues, diff_files)
+                ai_analysis = await self._ai_performance_analysis(performance_issues)
                 performance_issues.extend(ai_analysis)
             except Exception as e:
                 logger.warning(f"Performance AI analysis failed: {e}")
@@ -1043,18 +2092,37 @@ MR信息：
         logger.info(f"🔎 开始基础问题检测: {file_patch.filename}")
         
         issues = []
-        new_lines = [line for line in file_patch.patch.split('\n') if line.startswith('+')]
+        new_lines = file_patch.added_lines
         
         logger.info(f"  - 文件类型: {file_patch.edit_type}")
         logger.info(f"  - 新增行数: {len(new_lines)}")
         
         detected_issues_by_type = {}
-        
-        for line_num, line in enumerate(new_lines, 1):
-            line_content = line[1:].strip()  # 移除'+'符号
-            
+
+        line_contents = [line[1:].strip() for line in new_lines]  # 移除'+'符号
+
+        # 对全部新增行做一次正则扫描，按匹配位置映射回行号
+        joined = "\n".join(line_contents)
+        line_starts = list(itertools.accumulate((len(line_content) + 1 for line_content in line_contents), initial=0))
+        matched_kinds: Dict[int, set] = {}
+        for match in _BASIC_ISSUE_PATTERN.finditer(joined):
+            line_index = bisect.bisect_right(line_starts, match.start()) - 1
+            matched_kinds.setdefault(line_index, set()).add(match.lastgroup)
+        long_line_indexes = {
+            bisect.bisect_right(line_starts, match.start()) - 1
+            for match in _LONG_LINE_PATTERN.finditer(joined)
+        }
+
+        # 逐行日志只在DEBUG级别输出，检查一次即可，避免为被丢弃的日志格式化字符串
+        log_each_issue = logger.isEnabledFor(logging.DEBUG)
+
+        # 只遍历存在问题的行，其余行无需回到Python层
+        for line_index in sorted(long_line_indexes.union(matched_kinds)):
+            line_num, line_content = line_index + 1, line_contents[line_index]
+            kinds = matched_kinds.get(line_index, ())
+
             # 检查基础问题
-            if len(line_content) > 120:
+            if line_index in long_line_indexes:
                 issue = {
                     "type": "line_too_long",
                     "filename": file_patch.filename,
@@ -1066,9 +2134,10 @@ MR信息：
                 issues.append(issue)
                 detected_issues_by_type.setdefault("line_too_long", 0)
                 detected_issues_by_type["line_too_long"] += 1
-                logger.info(f"  ⚠️  行{line_num}: 代码行过长 ({len(line_content)} 字符)")
+                if log_each_issue:
+                    logger.debug("  ⚠️  行%d: 代码行过长 (%d 字符)", line_num, len(line_content))
             
-            if re.search(r"console\.log|print\(.*\)|System\.out\.println", line_content):
+            if "debug_statement" in kinds:
                 issue = {
                     "type": "debug_statement",
                     "filename": file_patch.filename,
@@ -1080,9 +2149,10 @@ MR信息：
                 issues.append(issue)
                 detected_issues_by_type.setdefault("debug_statement", 0)
                 detected_issues_by_type["debug_statement"] += 1
-                logger.info(f"  ⚠️  行{line_num}: 检测到调试语句: {line_content[:50]}...")
+                if log_each_issue:
+                    logger.debug("  ⚠️  行%d: 检测到调试语句: %s...", line_num, line_content[:50])
             
-            if re.search(r"TODO|FIXME|HACK", line_content, re.IGNORECASE):
+            if "todo_comment" in kinds:
                 issue = {
                     "type": "todo_comment",
                     "filename": file_patch.filename,
@@ -1094,7 +2164,8 @@ MR信息：
                 issues.append(issue)
                 detected_issues_by_type.setdefault("todo_comment", 0)
                 detected_issues_by_type["todo_comment"] += 1
-                logger.info(f"  ⚠️  行{line_num}: 发现TODO/FIXME: {line_content[:50]}...")
+                if log_each_issue:
+                    logger.debug("  ⚠️  行%d: 发现TODO/FIXME: %s...", line_num, line_content[:50])
         
         # 总结检测结果
         if issues:
@@ -1110,39 +2181,13 @@ MR信息：
     def _detect_security_issues(self, file_patch: FilePatchInfo) -> List[Dict]:
         """检测安全问题"""
         issues = []
-        new_lines = [line for line in file_patch.patch.split('\n') if line.startswith('+')]
-        
-        security_patterns = {
-            "sql_injection": {
-                "patterns": [r"execute\(.*\+.*\)", r"query\(.*\+.*\)", r"SELECT.*\+"],
-                "description": "可能存在SQL注入风险，检测到字符串拼接构建SQL查询",
-                "suggestion": "使用参数化查询或预编译语句防止SQL注入"
-            },
-            "xss": {
-                "patterns": [r"innerHTML\s*=", r"document\.write\(", r"eval\("],
-                "description": "可能存在跨站脚本(XSS)风险，检测到直接操作DOM或执行动态代码",
-                "suggestion": "对用户输入进行转义，使用安全的DOM操作方法"
-            },
-            "hardcoded_secrets": {
-                "patterns": [r"password\s*=\s*['\"]", r"api[_-]?key\s*=\s*['\"]", r"secret\s*=\s*['\"]"],
-                "description": "检测到硬编码的敏感信息，存在安全泄露风险",
-                "suggestion": "将敏感信息存储在环境变量或安全的配置管理系统中"
-            },
-            "path_traversal": {
-                "patterns": [r"\.\.\/", r"\.\.\\\\", r"os\.path\.join.*\.\."],
-                "description": "可能存在路径穿越风险，检测到相对路径操作",
-                "suggestion": "验证和清理文件路径，使用绝对路径或安全的路径处理方法"
-            },
-            "command_injection": {
-                "patterns": [r"os\.system\(", r"subprocess\.", r"exec\(", r"shell=True"],
-                "description": "可能存在命令注入风险，检测到系统命令执行",
-                "suggestion": "避免执行用户输入的命令，使用参数化的命令执行或白名单验证"
-            }
-        }
+        new_lines = _scannable_lines(file_patch.added_lines)
         
-        for line_num, line in enumerate(new_lines, 1):
-            for category, config in security_patterns.items():
-                if any(re.search(pattern, line, re.IGNORECASE) for pattern in config["patterns"]):
+        # 整个文件的新增行只做一次合并扫描，仅对命中的行再判断具体类别（同一行可命中多个类别）
+        for line_index in _candidate_line_indexes(_SECURITY_PREFILTER, new_lines, _SECURITY_TRIGGER):
+            line_num, line = line_index + 1, new_lines[line_index]
+            for category, config in _SECURITY_RULES.items():
+                if config["pattern"].search(line):
                     issues.append({
                         "type": "potential_security_issue",
                         "filename": file_patch.filename,
@@ -1158,34 +2203,12 @@ MR信息：
     def _detect_performance_issues(self, file_patch: FilePatchInfo) -> List[Dict]:
         """检测性能问题"""
         issues = []
-        new_lines = [line for line in file_patch.patch.split('\n') if line.startswith('+')]
-        
-        performance_patterns = {
-            "n_plus_1_query": {
-                "patterns": [r"for.*in.*:", r"\.get\(", r"\.filter\("],
-                "description": "可能存在N+1查询问题，在循环中进行数据库查询"
-            },
-            "inefficient_loop": {
-                "patterns": [r"for.*in.*for.*in", r"while.*while"],
-                "description": "检测到嵌套循环，可能存在性能问题"
-            },
-            "memory_leak": {
-                "patterns": [r"\.append\(", r"global\s+", r"cache\["],
-                "description": "可能存在内存泄漏风险，检测到持续增长的数据结构"
-            },
-            "blocking_io": {
-                "patterns": [r"requests\.get", r"urllib\.request", r"time\.sleep"],
-                "description": "检测到阻塞I/O操作，可能影响性能"
-            },
-            "inefficient_data_structure": {
-                "patterns": [r"list\(\)", r"dict\(\)", r"\[\].*in.*for"],
-                "description": "可能使用了低效的数据结构或操作"
-            }
-        }
+        new_lines = _scannable_lines(file_patch.added_lines)
         
-        for line_num, line in enumerate(new_lines, 1):
-            for issue_type, config in performance_patterns.items():
-                if any(re.search(pattern, line, re.IGNORECASE) for pattern in config["patterns"]):
+        for line_index in _candidate_line_indexes(_PERFORMANCE_PREFILTER, new_lines):
+            line_num, line = line_index + 1, new_lines[line_index]
+            for issue_type, config in _PERFORMANCE_RULES.items():
+                if config["pattern"].search(line):
                     issues.append({
                         "type": issue_type,
                         "filename": file_patch.filename,
@@ -1197,6 +2220,50 @@ MR信息：
         
         return issues
     
+    def _patch_tokens_batch(self, diff_files: List[FilePatchInfo]) -> List[int]:
+        """批量获取多个文件patch的token估算值
+
+        结果按模型缓存在 FilePatchInfo 上，未缓存的一次性交给 count_tokens_batch 计算。
+        """
+        missing = [file_patch for file_patch in diff_files if self.model not in file_patch.patch_token_counts]
+        if missing:
+            token_counts = self.token_manager.count_tokens_batch([file_patch.patch for file_patch in missing])
+            for file_patch, tokens in zip(missing, token_counts):
+                file_patch.patch_token_counts[self.model] = tokens
+        return [file_patch.patch_token_counts[self.model] for file_patch in diff_files]
+
+    def _pack_file_summaries(self, diff_files: List[FilePatchInfo], token_budget: int) -> List[str]:
+        """在token预算内打包文件变更摘要
+
+        按token数从小到大贪心放入完整patch，放不下的第一个文件截取首尾片段填满剩余预算；
+        返回的摘要保持文件原有顺序。
+        """
+        summaries: Dict[int, str] = {}
+        used_tokens = 0
+        tokens_by_file = self._patch_tokens_batch(diff_files)
+        for index in sorted(range(len(diff_files)), key=tokens_by_file.__getitem__):
+            file_patch = diff_files[index]
+            header = f"文件: {file_patch.filename}\n变更类型: {file_patch.edit_type}\n变更内容:\n"
+            header_tokens = self.token_manager.count_tokens(header)
+            patch_tokens = tokens_by_file[index]
+            remaining = token_budget - used_tokens - header_tokens
+
+            if patch_tokens <= remaining:
+                summaries[index] = f"{header}{file_patch.patch}\n"
+                used_tokens += header_tokens + patch_tokens
+                continue
+
+            # 超出预算：按剩余token占比截取首尾各一半
+            if remaining >= COMPREHENSIVE_MIN_FILE_TOKENS:
+                keep_chars = len(file_patch.patch) * remaining // patch_tokens // 2
+                patch = file_patch.patch
+                summaries[index] = f"{header}{patch[:keep_chars]}\n...\n{patch[len(patch) - keep_chars:]}\n"
+                used_tokens += header_tokens + remaining
+            break
+
+        logger.info(f"📦 综合分析提示词包含 {len(summaries)}/{len(diff_files)} 个文件，约 {used_tokens} tokens")
+        return [summaries[index] for index in sorted(summaries)]
+
     async def _ai_comprehensive_analysis(self, diff_files: List[FilePatchInfo], mr_info: Dict) -> Dict[str, Any]:
         """AI综合分析"""
         # 检查AI客户端是否可用
@@ -1204,23 +2271,19 @@ MR信息：
             logger.info("AI client not available, skipping AI comprehensive analysis")
             return {"findings": [], "suggestions": [], "overall_assessment": "AI客户端不可用，跳过AI分析"}
         
-        # 构建分析提示词
-        file_summaries = []
-        for file_patch in diff_files[:10]:  # 限制文件数量
-            summary = f"文件: {file_patch.filename}\n"
-            summary += f"变更类型: {file_patch.edit_type}\n"
-            summary += f"变更内容:\n{file_patch.patch[:1000]}...\n"  # 限制长度
-            file_summaries.append(summary)
-        
         # 构建基础提示词
-        base_prompt = f"""
+        mr_header = f"""
 请分析以下GitLab Merge Request的代码变更：
 
 MR信息：
 - 标题：{mr_info.get('title', '未知')}
 - 源分支：{mr_info.get('source_branch', '未知')}
 - 目标分支：{mr_info.get('target_branch', '未知')}
-
+"""
+        token_budget = (settings.max_tokens_per_request - COMPREHENSIVE_OUTPUT_TOKENS
+                        - self.token_manager.count_tokens(mr_header))
+        file_summaries = self._pack_file_summaries(diff_files, token_budget)
+        base_prompt = f"""{mr_header}
 文件变更：
 {chr(10).join(file_summaries)}
 
@@ -1262,14 +2325,14 @@ MR信息：
                 ],
                 model=self.model,
                 temperature=0.2,
-                max_tokens=4000,
+                max_tokens=COMPREHENSIVE_OUTPUT_TOKENS,
                 response_format=CODE_REVIEW_SCHEMA
             )
             
             # 清理响应内容，提取JSON部分
             cleaned_response = self._extract_json_from_response(response)
-            return json.loads(cleaned_response)
-        except json.JSONDecodeError as e:
+            return json_utils.loads(cleaned_response)
+        except json_utils.JSONDecodeError as e:
             logger.warning(f"AI response is not valid JSON: {e}")
             logger.debug(f"Raw response: {response[:500]}...")
             return {"findings": [], "suggestions": [], "overall_assessment": "AI分析失败"}
@@ -1279,20 +2342,22 @@ MR信息：
     
     def _extract_json_from_response(self, response: str) -> str:
         """从响应中提取JSON内容，增强容错性"""
-        import re
-        
         # 移除可能的markdown代码块标记
         response = response.strip()
         logger.debug(f"Processing response: {response[:200]}...")
         
+        # 结构化输出下响应本身就是合法JSON，直接返回，避免修复逻辑改动字符串内容
+        if response.startswith('{'):
+            json_content = _raw_decode_json_object(response, 0)
+            if json_content is not None:
+                return json_content
+        
         # 如果响应包含```json标记，提取其中的JSON
-        if "```json" in response:
-            start = response.find("```json") + 7
-            end = response.find("```", start)
-            if end != -1:
-                json_content = response[start:end].strip()
-                logger.debug("Extracted JSON from ```json markdown block")
-                return self._fix_common_json_issues(json_content)
+        code_block = _JSON_CODE_BLOCK_PATTERN.search(response)
+        if code_block:
+            json_content = code_block.group(1).strip()
+            logger.debug("Extracted JSON from ```json markdown block")
+            return self._fix_common_json_issues(json_content)
         
         # 如果响应包含```标记但没有json标识，也尝试提取
         if response.startswith("```") and response.endswith("```"):
@@ -1305,17 +2370,16 @@ MR信息：
         # 尝试找到JSON对象的开始和结束
         start_idx = response.find('{')
         if start_idx != -1:
-            # 从第一个{开始，找到匹配的}
-            brace_count = 0
-            for i, char in enumerate(response[start_idx:], start_idx):
-                if char == '{':
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        json_content = response[start_idx:i+1]
-                        logger.debug("Extracted JSON object from response")
-                        return self._fix_common_json_issues(json_content)
+            json_content = _raw_decode_json_object(response, start_idx)
+            if json_content is not None:
+                logger.debug("Decoded JSON object from response")
+                return json_content
+            # 不是合法JSON时，从第一个{开始单次扫描找到匹配的}（忽略字符串内的括号），再做修复
+            end_idx = _find_json_object_end(response, start_idx)
+            if end_idx != -1:
+                json_content = response[start_idx:end_idx + 1]
+                logger.debug("Extracted JSON object from response")
+                return self._fix_common_json_issues(json_content)
         
         # 如果没有找到JSON结构，尝试修复并返回
         logger.debug("No clear JSON structure found, attempting to fix response")
@@ -1323,28 +2387,18 @@ MR信息：
     
     def _fix_common_json_issues(self, json_str: str) -> str:
         """修复常见的JSON格式问题"""
-        import re
-        
         # 移除前后空白
         json_str = json_str.strip()
         
         # 如果不是以{开头，尝试找到并截取JSON部分
         if not json_str.startswith('{'):
-            match = re.search(r'\{.*\}', json_str, re.DOTALL)
+            match = _JSON_OBJECT_SPAN_PATTERN.search(json_str)
             if match:
                 json_str = match.group(0)
         
-        # 修复常见的JSON格式错误
-        # 1. 修复单引号为双引号
-        json_str = re.sub(r"'([^']*)':", r'"\1":', json_str)  # 'key': -> "key":
-        json_str = re.sub(r":\s*'([^']*)'", r': "\1"', json_str)  # : 'value' -> : "value"
-        
-        # 2. 修复未引用的键名
-        json_str = re.sub(r'(\w+):', r'"\1":', json_str)
-        
-        # 3. 修复尾随逗号
-        json_str = re.sub(r',\s*}', '}', json_str)
-        json_str = re.sub(r',\s*]', ']', json_str)
+        # 修复常见的JSON格式错误：单引号改双引号、未引用的键名、尾随逗号
+        for pattern, replacement in _JSON_FIX_RULES:
+            json_str = pattern.sub(replacement, json_str)
         
         # 4. 确保字符串值被正确引用
         # 这个比较复杂，先跳过高级修复
@@ -1354,8 +2408,6 @@ MR信息：
     
     def _aggressive_json_fix(self, json_str: str) -> str:
         """激进的JSON修复方法"""
-        import re
-        
         logger.debug("尝试激进JSON修复...")
         
         # 如果完全解析失败，尝试构建一个最小的有效JSON
@@ -1363,8 +2415,8 @@ MR信息：
             return '{"findings": [], "suggestions": []}'
         
         # 尝试提取findings和suggestions的内容
-        findings_match = re.search(r'"findings"\s*:\s*\[(.*?)\]', json_str, re.DOTALL)
-        suggestions_match = re.search(r'"suggestions"\s*:\s*\[(.*?)\]', json_str, re.DOTALL)
+        findings_match = _FINDINGS_ARRAY_PATTERN.search(json_str)
+        suggestions_match = _SUGGESTIONS_ARRAY_PATTERN.search(json_str)
         
         findings_content = findings_match.group(1) if findings_match else ""
         suggestions_content = suggestions_match.group(1) if suggestions_match else ""
@@ -1480,7 +2532,10 @@ MR信息：
             
             # 清理响应内容，提取JSON部分
             cleaned_response = self._extract_json_from_response(response)
-            result = json.loads(cleaned_response)
+            result = json_utils.loads(cleaned_response)
+            if not self._is_valid_security_result(result):
+                raise ValueError(f"Invalid security analysis result: {cleaned_response[:200]}")
+            self._cache_security_analysis(code_line, category, result)
             result.update({
                 "filename": filename,
                 "line_number": line_num,
@@ -1499,7 +2554,128 @@ MR信息：
                 "category": category
             }
     
-    async def _ai_performance_analysis(self, issues: List[Dict], diff_files: List[FilePatchInfo]) -> List[Dict]:
+    @staticmethod
+    def _is_valid_security_result(result: Any) -> bool:
+        """校验AI安全分析结论包含必需字段且类型正确，不合格的结论不缓存、按分析失败处理"""
+        return (
+            isinstance(result, dict)
+            and isinstance(result.get("is_vulnerability"), bool)
+            and isinstance(result.get("risk_level"), (int, float))
+            and not isinstance(result.get("risk_level"), bool)
+        )
+
+    def _security_cache_key(self, code_line: str, category: str) -> str:
+        return _content_digest(self.model, category, code_line.strip())
+
+    def _cached_security_analysis(self, filename: str, line_num: int, code_line: str,
+                                  category: str) -> Optional[Dict[str, Any]]:
+        """查询安全分析结论缓存，命中时返回附带本次文件名与行号的结果副本"""
+        cached = _security_analysis_cache.get(self._security_cache_key(code_line, category))
+        if cached is None:
+            return None
+        result = json_utils.loads(cached)
+        result.update({
+            "filename": filename,
+            "line_number": line_num,
+            "category": category
+        })
+        return result
+
+    def _cache_security_analysis(self, code_line: str, category: str, result: Dict[str, Any]):
+        """缓存AI给出的安全分析结论（不含文件名、行号等位置信息）"""
+        _security_analysis_cache.put(self._security_cache_key(code_line, category), json_utils.dumps(result))
+
+    async def _ai_security_analysis_batch(self, items: List[Tuple[str, int, str, str]]) -> List[Dict[str, Any]]:
+        """AI安全分析 - 多个疑似问题合并为一个请求，共享提示词前缀与一次网络往返
+
+        items 为 (文件名, 行号, 代码, 可能问题) 列表，返回与之一一对应的分析结果。
+        """
+        def fallback(description: str) -> List[Dict[str, Any]]:
+            return [{
+                "is_vulnerability": False,
+                "risk_level": 0,
+                "description": description,
+                "filename": filename,
+                "line_number": line_num,
+                "category": category
+            } for filename, line_num, _, category in items]
+
+        # 检查AI客户端是否可用
+        if not self._is_ai_available():
+            logger.info("AI client not available, skipping AI security analysis")
+            return fallback("AI客户端不可用，无法进行AI安全分析")
+
+        issue_list = "\n".join(
+            f"{idx}. 文件：{filename} 行号：{line_num} 可能问题：{category}\n   代码：{code_line}"
+            for idx, (filename, line_num, code_line, category) in enumerate(items)
+        )
+        base_prompt = f"""
+分析以下 {len(items)} 个代码行是否存在安全漏洞：
+
+{issue_list}
+
+请逐个分析（用 idx 标识对应的编号）：
+1. 这是否真的是一个安全漏洞？
+2. 风险级别（1-10）
+3. 具体的安全风险
+4. 修复建议
+"""
+
+        # 如果不支持结构化输出，添加JSON格式说明
+        if not self.client._supports_structured_output(self.model):
+            prompt = base_prompt + """
+请严格按照以下JSON格式回复，results 中每个编号一项：
+{
+    "results": [
+        {
+            "idx": 0,
+            "is_vulnerability": true/false,
+            "risk_level": 1-10,
+            "description": "详细描述",
+            "fix_suggestion": "修复建议"
+        }
+    ]
+}
+"""
+        else:
+            prompt = base_prompt
+
+        try:
+            response = await self.client.chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                model=self.model,
+                temperature=0.1,
+                max_tokens=500 * len(items),
+                response_format=SECURITY_BATCH_ANALYSIS_SCHEMA
+            )
+
+            cleaned_response = self._extract_json_from_response(response)
+            results_by_idx = {
+                result.get("idx"): result
+                for result in json_utils.loads(cleaned_response).get("results", [])
+                if isinstance(result, dict)
+            }
+        except Exception as e:
+            logger.error(f"Failed to analyze security issues in batch: {e}")
+            return fallback("分析失败")
+
+        # 按 idx 重新关联文件名、行号与类别，模型遗漏或字段不完整的编号记为分析失败
+        results = fallback("分析失败")
+        for idx, (filename, line_num, code_line, category) in enumerate(items):
+            result = results_by_idx.get(idx)
+            if not self._is_valid_security_result(result):
+                continue
+            result.pop("idx", None)
+            self._cache_security_analysis(code_line, category, result)
+            result.update({
+                "filename": filename,
+                "line_number": line_num,
+                "category": category
+            })
+            results[idx] = result
+        return results
+
+    async def _ai_performance_analysis(self, issues: List[Dict]) -> List[Dict]:
         """AI性能分析"""
         if not issues:
             return []
@@ -1509,11 +2685,12 @@ MR信息：
             logger.info("AI client not available, skipping AI performance analysis")
             return []
         
-        # 构建性能分析提示
-        issues_summary = "\n".join([
+        # 构建性能分析提示（最多提交前 PERFORMANCE_AI_MAX_ISSUES 个问题）
+        selected_issues = issues[:PERFORMANCE_AI_MAX_ISSUES]
+        issues_summary = "\n".join(
             f"- {issue['type']} in {issue['filename']}:{issue['line_number']}"
-            for issue in issues[:5]
-        ])
+            for issue in selected_issues
+        )
         
         # 构建基础提示词
         base_prompt = f"""
@@ -1544,13 +2721,13 @@ MR信息：
                 messages=[{"role": "user", "content": prompt}],
                 model=self.model,
                 temperature=0.2,
-                max_tokens=1000,
+                max_tokens=len(selected_issues) * PERFORMANCE_AI_TOKENS_PER_ISSUE + 200,
                 response_format=PERFORMANCE_ANALYSIS_SCHEMA
             )
             
             # 清理响应内容，提取JSON部分
             cleaned_response = self._extract_json_from_response(response)
-            return json.loads(cleaned_response)
+            return json_utils.loads(cleaned_response)
         except Exception as e:
             logger.error(f"Performance analysis failed: {e}")
             return []
@@ -1592,14 +2769,7 @@ MR信息：
         base_score = 8.0
         
         # 根据问题严重程度扣分
-        for finding in findings:
-            severity = finding.get("severity", "low")
-            if severity == "high":
-                base_score -= 1.0
-            elif severity == "medium":
-                base_score -= 0.5
-            else:
-                base_score -= 0.2
+        base_score -= _severity_penalty(findings, SEVERITY_SCORE_WEIGHTS)
         
         # 根据文件数量调整
         if len(diff_files) > 10:
@@ -1611,9 +2781,7 @@ MR信息：
         """计算安全评分"""
         base_score = 9.0
         
-        for issue in security_issues:
-            risk_level = issue.get("risk_level", 0)
-            base_score -= risk_level * 0.3
+        base_score -= 0.3 * sum(issue.get("risk_level", 0) for issue in security_issues)
         
         return max(base_score, 1.0)
     
@@ -1621,21 +2789,15 @@ MR信息：
         """计算性能评分"""
         base_score = 8.0
         
-        for issue in performance_issues:
-            severity = issue.get("severity", "low")
-            if severity == "high":
-                base_score -= 1.5
-            elif severity == "medium":
-                base_score -= 0.8
-            else:
-                base_score -= 0.3
+        base_score -= _severity_penalty(performance_issues, PERFORMANCE_SEVERITY_SCORE_WEIGHTS)
         
         return max(base_score, 2.0)
     
     def _generate_summary(self, findings: List[Dict], score: float, files_count: int) -> str:
         """生成分析总结"""
-        high_issues = len([f for f in findings if f.get("severity") == "high"])
-        medium_issues = len([f for f in findings if f.get("severity") == "medium"])
+        severity_counts = Counter(f.get("severity") for f in findings)
+        high_issues = severity_counts["high"]
+        medium_issues = severity_counts["medium"]
         
         if score >= 8.0:
             quality = "优秀"
@@ -1652,13 +2814,20 @@ MR信息：
         """生成改进建议"""
         recommendations = []
         
-        if any(f.get("type") == "debug_statement" for f in findings):
+        # 单次遍历收集出现过的问题类型与严重程度
+        types = set()
+        severities = set()
+        for f in findings:
+            types.add(f.get("type"))
+            severities.add(f.get("severity"))
+        
+        if "debug_statement" in types:
             recommendations.append("移除调试语句和日志输出")
         
-        if any(f.get("type") == "line_too_long" for f in findings):
+        if "line_too_long" in types:
             recommendations.append("保持代码行长度在合理范围内")
         
-        if any(f.get("severity") == "high" for f in findings):
+        if "high" in severities:
             recommendations.append("优先处理高风险问题")
         
         recommendations.append("建议添加单元测试覆盖变更代码")
@@ -1670,7 +2839,7 @@ MR信息：
         """生成安全建议"""
         recommendations = []
         
-        categories = set(issue.get("category") for issue in issues)
+        categories = {issue.get("category") for issue in issues}
         
         if "sql_injection" in categories:
             recommendations.append("使用参数化查询防止SQL注入")
@@ -1687,7 +2856,7 @@ MR信息：
         """生成性能建议"""
         recommendations = []
         
-        types = set(issue.get("type") for issue in issues)
+        types = {issue.get("type") for issue in issues}
         
         if "n_plus_1_query" in types:
             recommendations.append("优化数据库查询，避免N+1问题")
@@ -1713,8 +2882,6 @@ MR信息：
     
     def _estimate_analysis_cost(self, diff_files: List[FilePatchInfo]) -> float:
         """估算分析成本"""
-        total_tokens = 0
-        for file_patch in diff_files:
-            total_tokens += self.token_manager.count_tokens(file_patch.patch)
+        total_tokens = sum(self._patch_tokens_batch(diff_files))
         
         return self.token_manager.estimate_cost(total_tokens)
\ No newline at end of file
@@ -1,16 +1,31 @@
 """
 任务管理器 - 使用 Redis 存储异步审查任务的状态
 """
-import json
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from datetime import datetime
-from dataclasses import dataclass, asdict
+from collections import OrderedDict
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+import time
+from dataclasses import dataclass
 from enum import Enum
+from redis.exceptions import ResponseError
+from core import json_utils
 from core.redis_client import get_redis_client
 
 logger = logging.getLogger(__name__)
 
+# 原子更新任务字段：任务存在时 HSET 字段并发布进度事件，不存在时不写入（避免重建已过期任务）
+# TTL 只在创建任务时设置一次，HSET 不会改变已有的过期时间
+# KEYS[1] = 任务键；ARGV[1] = 事件频道，ARGV[2] = 事件内容，其余为 field/value 交替排列
+_UPDATE_TASK_FIELDS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('PUBLISH', ARGV[1], ARGV[2])
+return 1
+"""
+
 
 class TaskStatus(Enum):
     """任务状态枚举"""
@@ -20,27 +35,71 @@ class TaskStatus(Enum):
     FAILED = "failed"
 
 
-@dataclass
+# 状态字符串到 TaskStatus 取值的映射：解码时复用这 4 个常量字符串对象，而不是每个任务各持一份副本
+_CANONICAL_STATUS = {status.value: status.value for status in TaskStatus}
+
+
+@dataclass(slots=True)
 class Task:
-    """任务数据类"""
+    """任务数据类（slots：不创建实例 __dict__，降低轮询时大量创建 Task 的内存与属性访问开销）"""
     task_id: str
     status: str
     progress: int
     message: str
-    created_at: str
-    updated_at: str
+    created_at: float  # epoch 秒，仅在 HTTP 响应中转换为 ISO 格式
+    updated_at: float
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return asdict(self)
+        """转换为字典（Task 字段是扁平的，直接列出字段，无需 asdict 的递归反射与深拷贝）"""
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "result": self.result,
+            "error": self.error,
+        }
 
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> "Task":
         """从字典创建任务对象"""
         return cls(**data)
 
+    def to_hash(self) -> Dict[str, Any]:
+        """转换为 Redis Hash 字段（None 字段不写入，result 以 JSON 字符串存储）"""
+        fields = {
+            "task_id": self.task_id,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if self.result is not None:
+            fields["result"] = json_utils.dumps(self.result)
+        if self.error is not None:
+            fields["error"] = self.error
+        return fields
+
+    @classmethod
+    def from_hash(cls, fields: Dict[str, str]) -> "Task":
+        """从 Redis Hash 字段创建任务对象"""
+        result = fields.get("result")
+        return cls(
+            task_id=fields["task_id"],
+            status=_CANONICAL_STATUS.get(fields["status"], fields["status"]),
+            progress=int(fields["progress"]),
+            message=fields["message"],
+            created_at=float(fields["created_at"]),
+            updated_at=float(fields["updated_at"]),
+            result=json_utils.loads(result) if result is not None else None,
+            error=fields.get("error"),
+        )
+
 
 class TaskManager:
     """
@@ -50,7 +109,17 @@ class TaskManager:
 
     # Redis 键前缀
     TASK_PREFIX = "gitlab_reviewer:task:"
-    TASK_INDEX_KEY = "gitlab_reviewer:tasks"
+    # 任务索引：ZSET，score 为任务创建时间（epoch 秒），按时间范围清理旧任务
+    TASK_INDEX_KEY = "gitlab_reviewer:task_index"
+    # ZSCAN 每批扫描的索引条数，限制单次命令在 Redis 端的耗时
+    TASK_SCAN_COUNT = 500
+    # 同时在途的分批读取 pipeline 数上限
+    TASK_FETCH_CONCURRENCY = 4
+    # 结束状态：收到后停止推送进度事件
+    TERMINAL_STATUSES = frozenset({TaskStatus.COMPLETED.value, TaskStatus.FAILED.value})
+    # get_task 的进程内微缓存：高频轮询同一任务时合并为一次 Redis 读取
+    LOCAL_CACHE_TTL = 0.1
+    LOCAL_CACHE_SIZE = 1024
 
     def __init__(self, task_ttl: int = 86400):
         """
@@ -60,11 +129,19 @@ class TaskManager:
             task_ttl: 任务过期时间（秒），默认 24 小时
         """
         self.task_ttl = task_ttl
+        # 缓存共享的 Redis 客户端引用，避免每次操作都经过连接管理器
+        self._redis = None
+        # 字段更新脚本，首次使用时注册，之后通过 EVALSHA 调用
+        self._update_script = None
+        # task_id -> (读取时间, Task)，本进程写入或删除任务时失效
+        self._local_cache: "OrderedDict[str, Tuple[float, Task]]" = OrderedDict()
         logger.info("TaskManager initialized (using shared Redis connection)")
 
     async def _get_redis(self):
-        """获取共享的 Redis 客户端"""
-        return await get_redis_client()
+        """获取共享的 Redis 客户端（首次获取成功后缓存，连接失败时不缓存）"""
+        if self._redis is None:
+            self._redis = await get_redis_client()
+        return self._redis
 
     async def close(self):
         """
@@ -78,6 +155,11 @@ class TaskManager:
         """获取任务的 Redis 键"""
         return f"{self.TASK_PREFIX}{task_id}"
 
+    @staticmethod
+    def _get_events_channel(task_key: str) -> str:
+        """由任务的 Redis 键得到进度事件的 Pub/Sub 频道"""
+        return f"{task_key}:events"
+
     async def create_task(self, task_id: str) -> Task:
         """
         创建新任务
@@ -89,7 +171,7 @@ class TaskManager:
             Task: 创建的任务对象
         """
         redis_client = await self._get_redis()
-        now = datetime.now().isoformat()
+        now = time.time()
 
         task = Task(
             task_id=task_id,
@@ -100,14 +182,14 @@ class TaskManager:
             updated_at=now
         )
 
-        # 存储到 Redis
+        # 以 Hash 存储到 Redis 并添加到任务索引（同一个 pipeline，一次往返）
         task_key = self._get_task_key(task_id)
-        task_data = json.dumps(task.to_dict())
-
-        await redis_client.set(task_key, task_data, ex=self.task_ttl)
 
-        # 添加到任务索引
-        await redis_client.sadd(self.TASK_INDEX_KEY, task_id)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(task_key, mapping=task.to_hash())
+            pipe.expire(task_key, self.task_ttl)
+            pipe.zadd(self.TASK_INDEX_KEY, {task_id: task.created_at})
+            await pipe.execute()
 
         logger.info(f"Task {task_id} created in Redis")
         return task
@@ -122,22 +204,95 @@ class TaskManager:
         Returns:
             Optional[Task]: 任务对象，不存在则返回 None
         """
+        cached = self._local_cache.get(task_id)
+        if cached is not None:
+            if time.monotonic() - cached[0] <= self.LOCAL_CACHE_TTL:
+                return cached[1]
+            del self._local_cache[task_id]
+
         redis_client = await self._get_redis()
         task_key = self._get_task_key(task_id)
 
-        task_data = await redis_client.get(task_key)
+        try:
+            task_fields = await redis_client.hgetall(task_key)
+        except ResponseError as e:
+            # 升级前以 JSON 字符串存储的旧任务（WRONGTYPE），视为不存在，等待 TTL 自然过期
+            logger.warning(f"Task {task_id} has legacy format in Redis: {e}")
+            return None
 
-        if not task_data:
+        if not task_fields:
             logger.warning(f"Task {task_id} not found in Redis")
             return None
 
+        task = self._parse_task(task_id, task_fields)
+        if task:
+            self._local_cache[task_id] = (time.monotonic(), task)
+            if len(self._local_cache) > self.LOCAL_CACHE_SIZE:
+                self._local_cache.popitem(last=False)
+        return task
+
+    def _parse_task(self, task_id: str, task_fields: Dict[str, str]) -> Optional[Task]:
+        """解析 Redis Hash 中存储的任务字段，解析失败返回 None"""
         try:
-            data = json.loads(task_data)
-            return Task.from_dict(data)
+            return Task.from_hash(task_fields)
         except Exception as e:
             logger.error(f"Failed to parse task data for {task_id}: {e}")
             return None
 
+    async def _load_indexed_tasks(self, redis_client) -> Tuple[Dict[str, Task], List[str]]:
+        """
+        用 ZSCAN 分批遍历任务索引，每批用一个 pipeline 的 HGETALL 读取任务，
+        避免一次取出整个索引时长时间阻塞 Redis；各批的读取与后续 ZSCAN 并发进行
+        （最多 TASK_FETCH_CONCURRENCY 个在途）
+
+        Returns:
+            Tuple[Dict[str, Task], List[str]]: 存在的任务字典，以及已过期/无法解析的任务 ID 列表
+        """
+        semaphore = asyncio.Semaphore(self.TASK_FETCH_CONCURRENCY)
+
+        async def fetch_chunk(task_ids: List[str]) -> List[Any]:
+            async with semaphore:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for task_id in task_ids:
+                        pipe.hgetall(self._get_task_key(task_id))
+                    # 旧格式的字符串键会返回 WRONGTYPE 异常，按无效任务处理
+                    return await pipe.execute(raise_on_error=False)
+
+        chunks: List[List[str]] = []
+        fetches: List[asyncio.Task] = []
+        seen = set()
+        cursor = 0
+        try:
+            while True:
+                cursor, entries = await redis_client.zscan(
+                    self.TASK_INDEX_KEY, cursor=cursor, count=self.TASK_SCAN_COUNT
+                )
+                # ZSCAN 可能返回重复成员，已处理过的跳过
+                task_ids = [task_id for task_id, _ in entries if task_id not in seen]
+                if task_ids:
+                    seen.update(task_ids)
+                    chunks.append(task_ids)
+                    fetches.append(asyncio.create_task(fetch_chunk(task_ids)))
+                if cursor == 0:
+                    break
+            results = await asyncio.gather(*fetches)
+        finally:
+            for fetch in fetches:
+                fetch.cancel()
+
+        tasks = {}
+        stale_ids = []
+        for task_ids, raw_tasks in zip(chunks, results):
+            for task_id, task_fields in zip(task_ids, raw_tasks):
+                task = None
+                if task_fields and not isinstance(task_fields, Exception):
+                    task = self._parse_task(task_id, task_fields)
+                if task:
+                    tasks[task_id] = task
+                else:
+                    stale_ids.append(task_id)
+        return tasks, stale_ids
+
     async def update_progress(self, task_id: str, progress: int, message: str):
         """
         更新任务进度
@@ -147,23 +302,17 @@ class TaskManager:
             progress: 进度百分比 (0-100)
             message: 进度消息
         """
-        task = await self.get_task(task_id)
-        if not task:
+        # 只写入变化的字段，无需先读取或重新序列化整个任务
+        updated = await self._update_fields(task_id, {
+            "status": TaskStatus.RUNNING.value,
+            "progress": min(100, max(0, progress)),
+            "message": message,
+            "updated_at": time.time(),
+        })
+        if not updated:
             logger.warning(f"Task {task_id} not found when updating progress")
             return
 
-        task.status = TaskStatus.RUNNING.value
-        task.progress = min(100, max(0, progress))
-        task.message = message
-        task.updated_at = datetime.now().isoformat()
-
-        # 保存到 Redis
-        redis_client = await self._get_redis()
-        task_key = self._get_task_key(task_id)
-        task_data = json.dumps(task.to_dict())
-
-        await redis_client.set(task_key, task_data, ex=self.task_ttl)
-
         logger.info(f"Task {task_id} progress: {progress}% - {message}")
 
     async def complete_task(self, task_id: str, result: Dict[str, Any]):
@@ -174,25 +323,17 @@ class TaskManager:
             task_id: 任务ID
             result: 任务结果
         """
-        task = await self.get_task(task_id)
-        if not task:
+        updated = await self._update_fields(task_id, {
+            "status": TaskStatus.COMPLETED.value,
+            "progress": 100,
+            "message": "任务完成",
+            "result": json_utils.dumps(result),
+            "updated_at": time.time(),
+        })
+        if not updated:
             logger.warning(f"Task {task_id} not found when completing")
             return
 
-        task.status = TaskStatus.COMPLETED.value
-        task.progress = 100
-        task.message = "任务完成"
-        task.result = result
-        task.updated_at = datetime.now().isoformat()
-
-        # 保存到 Redis
-        redis_client = await self._get_redis()
-        task_key = self._get_task_key(task_id)
-        task_data = json.dumps(task.to_dict())
-
-        # 完成的任务可以设置更长的过期时间，方便查询
-        await redis_client.set(task_key, task_data, ex=self.task_ttl)
-
         logger.info(f"Task {task_id} completed")
 
     async def fail_task(self, task_id: str, error: str):
@@ -203,24 +344,114 @@ class TaskManager:
             task_id: 任务ID
             error: 错误信息
         """
-        task = await self.get_task(task_id)
-        if not task:
+        updated = await self._update_fields(task_id, {
+            "status": TaskStatus.FAILED.value,
+            "message": "任务失败",
+            "error": error,
+            "updated_at": time.time(),
+        })
+        if not updated:
             logger.warning(f"Task {task_id} not found when failing")
             return
 
-        task.status = TaskStatus.FAILED.value
-        task.message = "任务失败"
-        task.error = error
-        task.updated_at = datetime.now().isoformat()
+        logger.error(f"Task {task_id} failed: {error}")
 
-        # 保存到 Redis
+    async def _update_fields(self, task_id: str, fields: Dict[str, Any]) -> bool:
+        """
+        通过 Lua 脚本原子地更新任务的部分字段并发布进度事件（EVALSHA，一次往返，无需先读取任务）
+
+        不刷新 TTL：任务从创建起按 task_ttl 过期
+
+        事件内容为本次更新的字段（不含体积较大的 result，订阅方需要时再查询结果）
+
+        Returns:
+            bool: 任务是否存在（不存在时不写入）
+        """
         redis_client = await self._get_redis()
+        if self._update_script is None:
+            self._update_script = redis_client.register_script(_UPDATE_TASK_FIELDS_LUA)
+
+        # 任务键只拼接一次，频道由其派生；事件与脚本参数在同一次遍历中构建
         task_key = self._get_task_key(task_id)
-        task_data = json.dumps(task.to_dict())
+        event = {"task_id": task_id}
+        field_args = []
+        for field, value in fields.items():
+            field_args.append(field)
+            field_args.append(value)
+            if field != "result":
+                event[field] = value
+
+        # 显式传入当前客户端：缓存的客户端被替换后脚本对象仍可复用
+        updated = await self._update_script(
+            keys=[task_key],
+            args=[self._get_events_channel(task_key), json_utils.dumps(event), *field_args],
+            client=redis_client,
+        )
+        self._local_cache.pop(task_id, None)
+        return bool(updated)
+
+    async def subscribe_task_events(
+        self, task_id: str, idle_timeout: float = 15.0
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        订阅任务进度事件（Redis Pub/Sub），替代轮询 get_task
 
-        await redis_client.set(task_key, task_data, ex=self.task_ttl)
+        先订阅再读取一次当前状态作为首个事件，避免错过订阅之前的更新；
+        任务完成/失败或已不存在时结束。超过 idle_timeout 秒没有事件时产出 None，
+        调用方可借此发送心跳。
 
-        logger.error(f"Task {task_id} failed: {error}")
+        Args:
+            task_id: 任务ID
+            idle_timeout: 空闲等待时间（秒）
+
+        Yields:
+            Optional[Dict[str, Any]]: 进度事件（task_id/status/progress/message/updated_at 等），心跳时为 None
+        """
+        redis_client = await self._get_redis()
+        task_key = self._get_task_key(task_id)
+        channel = self._get_events_channel(task_key)
+        pubsub = redis_client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            # 快照必须在订阅之后从 Redis 读取，不能使用本地微缓存
+            self._local_cache.pop(task_id, None)
+            task = await self.get_task(task_id)
+            if not task:
+                return
+
+            status = task.status
+            yield {
+                "task_id": task_id,
+                "status": task.status,
+                "progress": task.progress,
+                "message": task.message,
+                "updated_at": task.updated_at,
+            }
+
+            # 订阅确认等被忽略的消息也会让 get_message 提前返回 None，按实际经过的时间判断是否空闲超时
+            idle_deadline = time.monotonic() + idle_timeout
+            while status not in self.TERMINAL_STATUSES:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=max(idle_deadline - time.monotonic(), 0.0)
+                )
+                if message is None:
+                    if time.monotonic() < idle_deadline:
+                        continue
+                    # 长时间无事件：任务已过期则结束，否则产出心跳
+                    if not await redis_client.exists(task_key):
+                        return
+                    yield None
+                    idle_deadline = time.monotonic() + idle_timeout
+                    continue
+
+                idle_deadline = time.monotonic() + idle_timeout
+                event = json_utils.loads(message["data"])
+                status = event.get("status")
+                yield event
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
 
     async def delete_task(self, task_id: str) -> bool:
         """
@@ -235,10 +466,12 @@ class TaskManager:
         redis_client = await self._get_redis()
         task_key = self._get_task_key(task_id)
 
-        result = await redis_client.delete(task_key)
-
-        # 从索引中移除
-        await redis_client.srem(self.TASK_INDEX_KEY, task_id)
+        # 删除任务并从索引中移除（同一个 pipeline，一次往返）
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.delete(task_key)
+            pipe.zrem(self.TASK_INDEX_KEY, task_id)
+            result, _ = await pipe.execute()
+        self._local_cache.pop(task_id, None)
 
         if result > 0:
             logger.info(f"Task {task_id} deleted from Redis")
@@ -254,17 +487,11 @@ class TaskManager:
         """
         redis_client = await self._get_redis()
 
-        # 从索引获取所有任务 ID
-        task_ids = await redis_client.smembers(self.TASK_INDEX_KEY)
+        tasks, stale_ids = await self._load_indexed_tasks(redis_client)
 
-        tasks = {}
-        for task_id in task_ids:
-            task = await self.get_task(task_id)
-            if task:
-                tasks[task_id] = task
-            else:
-                # 如果任务不存在，从索引中移除
-                await redis_client.srem(self.TASK_INDEX_KEY, task_id)
+        # 如果任务不存在，从索引中移除
+        if stale_ids:
+            await redis_client.zrem(self.TASK_INDEX_KEY, *stale_ids)
 
         return tasks
 
@@ -275,33 +502,26 @@ class TaskManager:
         注意：由于使用了 Redis TTL，过期的任务会自动删除
         这个方法主要用于清理索引中的过期任务引用
 
+        索引按创建时间排序，只需一次 ZRANGEBYSCORE 取出超龄任务，无需读取任务内容
+
         Args:
             max_age_hours: 最大保留时间（小时）
         """
         redis_client = await self._get_redis()
-        now = datetime.now()
-
-        # 获取所有任务 ID
-        task_ids = await redis_client.smembers(self.TASK_INDEX_KEY)
-
-        cleaned_count = 0
-        for task_id in task_ids:
-            task = await self.get_task(task_id)
-
-            # 如果任务不存在（已过期），从索引中移除
-            if not task:
-                await redis_client.srem(self.TASK_INDEX_KEY, task_id)
-                cleaned_count += 1
-                continue
+        cutoff = time.time() - max_age_hours * 3600
 
-            # 检查任务年龄
-            created = datetime.fromisoformat(task.created_at)
-            age = (now - created).total_seconds() / 3600
+        old_ids = await redis_client.zrangebyscore(self.TASK_INDEX_KEY, "-inf", f"({cutoff}")
 
-            if age > max_age_hours:
-                await self.delete_task(task_id)
-                cleaned_count += 1
+        # 删除旧任务（已被 TTL 删除的键忽略）并清理索引（同一个 pipeline，一次往返）
+        if old_ids:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.delete(*(self._get_task_key(task_id) for task_id in old_ids))
+                pipe.zrem(self.TASK_INDEX_KEY, *old_ids)
+                await pipe.execute()
+            for task_id in old_ids:
+                self._local_cache.pop(task_id, None)
 
+        cleaned_count = len(old_ids)
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old tasks")
 
@@ -313,7 +533,7 @@ class TaskManager:
             int: 任务数量
         """
         redis_client = await self._get_redis()
-        return await redis_client.scard(self.TASK_INDEX_KEY)
+        return await redis_client.zcard(self.TASK_INDEX_KEY)
 
     async def get_tasks_by_status(self, status: TaskStatus) -> Dict[str, Task]:
         """
@@ -347,6 +567,8 @@ class TaskManager:
             return True
         except Exception as e:
             logger.error(f"Redis health check failed: {e}")
+            # 丢弃缓存的客户端，下次操作重新从连接管理器获取
+            self._redis = None
             return False
 
 